@@ -1,19 +1,34 @@
 #!usr/bin/env python
 # implement of deep forest and improved deep forest.
 
-import itertools
+import logging
+import time
 import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from joblib import Parallel, delayed, effective_n_jobs
 from sklearn.ensemble import RandomForestClassifier
 from sklearn.model_selection import train_test_split
 from sklearn.metrics import accuracy_score
 from sklearn.feature_selection import SelectFromModel
-import random
+from hist_forest import HistRandomForestClassifier
+from packed_forest import PackedForest, PackedEnsemble
+from profiling import profiled
+
+logger = logging.getLogger(__name__)
+
+# First item of the keys of the seeds derived from random_state.
+_SPLIT_SEED, _MGS_SEED, _CASCADE_SEED, _MGS_SUBSAMPLE_SEED = 0, 1, 2, 3
+
+# Number of window values sliced at once by the Multi Grain Scanning with
+# mgs_batch_size='auto' (128MB of float64).
+_MGS_BATCH_VALUES = 1 << 24
 
 class gcForest(object):
 
     def __init__(self, shape_1X=None, n_mgsRF=2, n_mgsRFtree=50, window=None, stride=1,
-                 cascade_test_size=0.2, n_cascadeRF=2, n_cascadeRFtree=101, min_cascade_layer=2, max_cascade_layer=np.inf,
-                 min_samples_mgs=0.1, min_samples_cascade=0.1, tolerance=0.0, version=0, n_jobs=-1):
+                 cascade_test_size=0.2, cascade_growth='split', n_cascadeRF=2, n_cascadeRFtree=101, min_cascade_layer=2, max_cascade_layer=np.inf,
+                 min_samples_mgs=0.1, min_samples_cascade=0.1, tolerance=0.0, version=0, max_layer_features=None, mgs_batch_size='auto', mgs_max_windows=None,
+                 forest_backend='exact', forest_bins=256, random_state=None, callbacks=None, n_jobs=-1):
         """ gcForest Classifier.
 
         :param shape_1X: int or tuple list or np.array (default=None)
@@ -29,7 +44,7 @@ class gcForest(object):
 
         :param window: int (default=None)
             List of window sizes to use during Multi Grain Scanning.
-            If 'None' no slicing will be done.
+            If 'None' a single window as wide as the sample is used.
 
         :param stride: int (default=1)
             Step used when slicing the data.
@@ -37,6 +52,14 @@ class gcForest(object):
         :param cascade_test_size: float or int (default=0.2)
             Split fraction or absolute number for cascade training set splitting.
 
+        :param cascade_growth: str (default='split')
+            How the accuracy deciding the growth of the cascade is estimated.
+            If 'split', cascade_test_size of the training set is held out and every new
+            layer is evaluated on it.
+            If 'oob', the cascade is trained on the whole training set and a layer is
+            evaluated with the mean of the out-of-bag class vectors of its forests
+            (already computed during training, no extra prediction pass).
+
         :param n_cascadeRF: int (default=2)
             Number of Random Forests in a cascade layer.
             For each pseudo Random Forest a complete Random Forest is created, hence
@@ -74,20 +97,68 @@ class gcForest(object):
             If 0, then the program implements the deep forest
             If 1, then the program implements the improved deep forest
 
+        :param max_layer_features: int (default=None)
+            Improved deep forest only. Number of columns of a layer input passed on to the
+            next layer (the most important ones for the layer Random Forests), the next
+            layer input being these columns followed by the class vectors of the layer.
+            If 'None' as many columns as the cascade input are kept.
+
+        :param mgs_batch_size: int or str (default='auto')
+            Number of samples read and sliced at once during the Multi Grain Scanning
+            (their windows are sent together through the Random Forests).
+            If 'auto' the batches hold about 2**24 window values whatever the number
+            and size of the windows. If 'None' all the samples are processed in a single
+            batch.
+
+        :param mgs_max_windows: int (default=None)
+            Maximum number of windows (per window size) used to train the Multi Grain
+            Scanning Random Forests, drawn at random in each class in proportion to its
+            number of samples. If 'None' all the windows are used.
+
+        :param forest_backend: str (default='exact')
+            Random Forests of the Multi Grain Scanning and of the cascade.
+            If 'exact', sklearn RandomForestClassifier (every distinct value of a feature
+            is a candidate split).
+            If 'hist', hist_forest.HistRandomForestClassifier: the forests are grown on the
+            quantile bins of their input (at most forest_bins per feature) and only the bin
+            boundaries are candidate splits. They are packed, predicted and saved as the
+            exact ones.
+
+        :param forest_bins: int (default=256)
+            Maximum number of bins of a feature with forest_backend='hist', at most 256.
+
+        :param random_state: int (default=None)
+            Seed of the model. The seeds of the cascade train/validation split and of
+            every Random Forest are derived from it (numpy SeedSequence keyed by the
+            window size or layer and the rank of the forest), so that two fits on the
+            same data give the same model whatever n_jobs.
+            If 'None' the forests use the global numpy random state.
+
+        :param callbacks: list (default=None)
+            Functions called with a dict (JSON serializable) at the end of each stage:
+            fit, predict_proba, every Multi Grain Scanning window, cascade layer and
+            cascade evaluation. The dict holds the 'event' name, 'wall_time' and 'cpu_time'
+            in seconds, the 'peak_memory' (growth of the peak resident set size of the
+            process during the stage in bytes, 'None' if unknown), the stage parameters
+            (window, layer, ..) and the size of its 'input' and 'output' arrays.
+            See profiling.Recorder. If 'None' nothing is measured.
+
         :param n_jobs: int (default=-1)
             The number of jobs to run in parallel for any Random Forest fit and predict.
             If -1, then the number of jobs is set to the number of cores.
         """
         setattr(self, 'shape_1X', shape_1X)
         setattr(self, 'n_layer', 0)
-        setattr(self, '_n_samples', 0)
         setattr(self, 'n_cascadeRF', int(n_cascadeRF))
         if isinstance(window, int):
             setattr(self, 'window', [window])
-        elif isinstance(window, list):
-            setattr(self, 'window', window)
+        elif isinstance(window, (list, tuple)):
+            setattr(self, 'window', list(window))
+        else:
+            setattr(self, 'window', None)
         setattr(self, 'stride', stride)
         setattr(self, 'cascade_test_size', cascade_test_size)
+        setattr(self, 'cascade_growth', cascade_growth)
         setattr(self, 'n_mgsRF', int(n_mgsRF))
         setattr(self, 'n_mgsRFtree', int(n_mgsRFtree))
         setattr(self, 'n_cascadeRFtree', int(n_cascadeRFtree))
@@ -97,27 +168,43 @@ class gcForest(object):
         setattr(self, 'min_samples_cascade', min_samples_cascade)
         setattr(self, 'tolerance', tolerance)
         setattr(self, 'version', version)
+        setattr(self, 'max_layer_features', max_layer_features)
+        setattr(self, 'mgs_batch_size', mgs_batch_size)
+        setattr(self, 'mgs_max_windows', mgs_max_windows)
+        setattr(self, 'forest_backend', forest_backend)
+        setattr(self, 'forest_bins', forest_bins)
+        setattr(self, 'random_state', random_state)
+        setattr(self, 'callbacks', callbacks)
         setattr(self, 'n_jobs', n_jobs)
         
-    def fit(self, X, y):
+    @profiled('fit', lambda self, X, y, mgs_out=None: {'input': X})
+    def fit(self, X, y, mgs_out=None):
         """ Training the gcForest on input data X and associated target y.
 
         :param X: np.array
             Array containing the input samples.
             Must be of shape [n_samples, data] where data is a 1D array.
+            Can be a memory map, see mg_scanning.
 
         :param y: np.array
             1D array containing the target values.
             Must be of shape [n_samples]
+
+        :param mgs_out: str (default=None)
+            Path of a .npy file the Multi Grain Scanning output is written to.
+            If 'None' it is kept in memory.
         """
         if np.shape(X)[0] != len(y):
             raise ValueError('Sizes of y and X do not match.')
 
-        mgs_X = self.mg_scanning(X, y)
+        mgs_X = self.mg_scanning(X, y, out=mgs_out)
         _ = self.cascade_forest(mgs_X, y)
 
+    @profiled('predict_proba', lambda self, X: {'input': X})
     def predict_proba(self, X):
         """ Predict the class probabilities of unknown samples X.
+        The fitted model is not modified (apart from packing the forests on first use),
+        several threads can predict with the same model at the same time.
 
         :param X: np.array
             Array containing the input samples.
@@ -147,8 +234,30 @@ class gcForest(object):
 
         return predictions
 
-    def mg_scanning(self, X, y=None):
+    def compile(self):
+        """ Pack the trained Random Forests of the Multi Grain Scanning and of each
+        cascade layer into PackedEnsemble instances used for all the predictions.
+        This is otherwise done the first time a layer is used, calling it after 'fit'
+        keeps the packing time out of the first prediction (and avoids concurrent first
+        predictions packing the same layer twice).
+
+        :return: gcForest
+            The model itself.
+        """
+        if getattr(self, 'n_mgsRF') > 0:
+            _, windows = self._scanning_layout()
+            for wdw_size in windows:
+                self._mgs_ensemble(wdw_size)
+        for layer in range(1, getattr(self, 'n_layer') + 1):
+            self._layer_ensemble(layer)
+
+        return self
+
+    def mg_scanning(self, X, y=None, out=None):
         """ Performs a Multi Grain Scanning on input data.
+        X is only read by blocks of mgs_batch_size samples, so it can be a memory map
+        (or any array-like with a shape supporting slicing, e.g. a h5py dataset)
+        larger than the memory, and the output can be written to a memory map on disk.
 
         :param X: np.array
             Array containing the input samples.
@@ -156,27 +265,58 @@ class gcForest(object):
 
         :param y: np.array (default=None)
 
+        :param out: str (default=None)
+            Path of a .npy file the output is written to, the returned array is then
+            a memory map of this file. If 'None' the output is kept in memory.
+
         :return: np.array
             Array of shape [n_samples, .. ] containing Multi Grain Scanning sliced data.
         """
-        setattr(self, '_n_samples', np.shape(X)[0])
-        shape_1X = getattr(self, 'shape_1X')
-        if isinstance(shape_1X, int):
-            shape_1X = [1,shape_1X]
-        if not getattr(self, 'window'):
-            setattr(self, 'window', [shape_1X[1]])
-
-        mgs_pred_prob = []
+        shape_1X, windows = self._scanning_layout()
+        if y is not None:
+            self._clear_packed('_packed_mgs_')
+
+        if getattr(self, 'n_mgsRF') <= 0:
+            mgs_pred_prob = []
+            for wdw_size in windows:
+                mgs_pred_prob.append(self.window_slicing_pred_prob(X, wdw_size, shape_1X, y=y))
+            return np.concatenate(mgs_pred_prob, axis=1)
+
+        # Number of output columns of each window size: n_windows * n_forests * n_classes.
+        n_forests = 2 * getattr(self, 'n_mgsRF')
+        n_cols = []
+        for wdw_size in windows:
+            if y is not None:
+                n_classes = len(np.unique(y))
+            else:
+                n_classes = len(self._mgs_ensemble(wdw_size).forest.classes_)
+            grid, _ = self._window_grid(X, wdw_size, shape_1X)
+            n_cols.append(int(np.prod(grid)) * n_forests * n_classes)
+
+        shape = (np.shape(X)[0], int(np.sum(n_cols)))
+        if out is None:
+            mgs_X = np.empty(shape)
+        else:
+            mgs_X = np.lib.format.open_memmap(out, mode='w+', dtype=np.float64, shape=shape)
 
-        for wdw_size in getattr(self, 'window'):
-            wdw_pred_prob = self.window_slicing_pred_prob(X, wdw_size, shape_1X, y=y)
-            mgs_pred_prob.append(wdw_pred_prob)
+        col = 0
+        for wdw_size, n_col in zip(windows, n_cols):
+            self.window_slicing_pred_prob(X, wdw_size, shape_1X, y=y, out=mgs_X[:, col:col + n_col])
+            col += n_col
+        if out is not None:
+            mgs_X.flush()
 
-        return np.concatenate(mgs_pred_prob, axis=1)
+        return mgs_X
 
-    def window_slicing_pred_prob(self, X, window, shape_1X, y=None):
+    @profiled('mgs_window', lambda self, X, window, shape_1X, y=None, out=None:
+              {'window': window, 'training': y is not None, 'input': X})
+    def window_slicing_pred_prob(self, X, window, shape_1X, y=None, out=None):
         """ Performs a window slicing of the input data and send them through Random Forests.
         If target values 'y' are provided sliced data are then used to train the Random Forests.
+        The samples are sliced by blocks of mgs_batch_size samples. When mgs_max_windows
+        is set, the forests are trained on a stratified subsample of the windows: the
+        output of these windows is their out-of-bag prediction and the other windows are
+        predicted by the trained forests.
 
         :param X: np.array
             Array containing the input samples.
@@ -191,6 +331,10 @@ class gcForest(object):
         :param y: np.array (default=None)
             Target values. If 'None' no training is done.
 
+        :param out: np.array (default=None)
+            Array of shape [n_samples, ..] the output is written to (e.g. columns of a
+            memory map). If 'None' a new array is returned.
+
         :return: np.array
             Array of size [n_samples, ..] containing the Random Forest.
             prediction probability for each input sample.
@@ -199,50 +343,139 @@ class gcForest(object):
         n_tree = getattr(self, 'n_mgsRFtree')
         min_samples = getattr(self, 'min_samples_mgs')
         stride = getattr(self, 'stride')
-        n_jobs = getattr(self, 'n_jobs')
         
         if n_mgsRF <= 0:
             return X
 
         if shape_1X[0] > 1:
-            print('Slicing Images...')
-            sliced_X, sliced_y = self._window_slicing_img(X, window, shape_1X, y=y, stride=stride)
+            logger.info('Slicing Images...')
+            slicing = self._window_slicing_img
         else:
-            print('Slicing Sequence...')
-            sliced_X, sliced_y = self._window_slicing_sequence(X, window, shape_1X, y=y, stride=stride)
+            logger.info('Slicing Sequence...')
+            slicing = self._window_slicing_sequence
+        grid, len_window = self._window_grid(X, window, shape_1X)
+        n_windows = int(np.prod(grid))
+        n_samples = np.shape(X)[0]
+        batch_size = getattr(self, 'mgs_batch_size')
+        if batch_size == 'auto':
+            batch_size = max(1, _MGS_BATCH_VALUES // (n_windows * len_window))
+        batch_size = batch_size or n_samples
+
+        def sliced_batches():
+            for start in range(0, n_samples, batch_size):
+                stop = min(start + batch_size, n_samples)
+                sliced_X, _ = slicing(np.asarray(X[start:stop]), window, shape_1X, stride=stride)
+                yield start, stop, sliced_X
 
         if y is not None:
+            # Flat indices (sample * n_windows + window) of the training windows, 'None' for all.
+            selected = self._mgs_window_subsample(y, n_windows, window)
+            n_train = n_samples * n_windows if selected is None else len(selected)
+            # Forests work on float32 anyway, the windows are copied only once.
+            train_X = np.empty((n_train, len_window), dtype=np.float32)
+            for start, stop, sliced_X in sliced_batches():
+                if selected is None:
+                    train_X[start * n_windows:stop * n_windows].reshape(sliced_X.shape)[...] = sliced_X
+                else:
+                    lo, hi = np.searchsorted(selected, [start * n_windows, stop * n_windows])
+                    local = selected[lo:hi] - start * n_windows
+                    index = (local // n_windows,) + np.unravel_index(local % n_windows, grid)
+                    train_X[lo:hi] = sliced_X[index].reshape(hi - lo, len_window)
+            if selected is None:
+                sliced_y = np.repeat(y, n_windows)
+            else:
+                sliced_y = np.asarray(y)[selected // n_windows]
+
+            oob_pred = []
             for k in range(n_mgsRF):
-                prf = RandomForestClassifier(n_estimators=n_tree, max_features='sqrt',
-                                             oob_score=True, n_jobs=n_jobs)
-                crf = RandomForestClassifier(n_estimators=n_tree, max_features=1,
-                                             oob_score=True, n_jobs=n_jobs)
-                print('Training MGS Random Forests...')
-                prf.fit(sliced_X, sliced_y)
-                crf.fit(sliced_X, sliced_y)
+                prf = self._random_forest(n_tree, 'sqrt', self._random_seed(_MGS_SEED, window, 2*k))
+                crf = self._random_forest(n_tree, 1, self._random_seed(_MGS_SEED, window, 2*k+1))
+                logger.info('Training MGS Random Forests...')
+                prf.fit(train_X, sliced_y)
+                crf.fit(train_X, sliced_y)
                 setattr(self, '_mgsprf_{}_{}'.format(window,k), prf)
                 setattr(self, '_mgscrf_{}_{}'.format(window,k), crf)
-                pred_prob_prf = prf.oob_decision_function_
-                pred_prob_crf = crf.oob_decision_function_
-                
-                if k == 0:
-                    pred_prob = np.c_[pred_prob_prf, pred_prob_crf]
-                else:
-                    pred_prob = np.concatenate((pred_prob, pred_prob_prf, pred_prob_crf), axis=1)
+                oob_pred.append(prf.oob_decision_function_)
+                oob_pred.append(crf.oob_decision_function_)
+            oob_pred = np.concatenate(oob_pred, axis=1)
+            del train_X
+
+            if selected is None:
+                if out is None:
+                    return oob_pred.reshape([n_samples, -1])
+                out[...] = oob_pred.reshape([n_samples, -1])
+                return out
+
+        ensemble = self._mgs_ensemble(window)
+        if out is None:
+            out = np.empty((n_samples, n_windows * len(ensemble) * len(ensemble.forest.classes_)))
+        for start, stop, sliced_X in sliced_batches():
+            pred_prob = np.concatenate(ensemble.predict_proba(sliced_X.reshape(-1, len_window)), axis=1)
+            if y is not None:
+                lo, hi = np.searchsorted(selected, [start * n_windows, stop * n_windows])
+                pred_prob[selected[lo:hi] - start * n_windows] = oob_pred[lo:hi]
+            out[start:stop] = pred_prob.reshape([stop - start, -1])
+
+        return out
+
+    def _scanning_layout(self):
+        """ Shape of a single sample [n_lines, n_cols] and window sizes of the
+        Multi Grain Scanning (a single window as wide as the sample if none was given).
+
+        :return: list and list
+        """
+        shape_1X = getattr(self, 'shape_1X')
+        if isinstance(shape_1X, int):
+            shape_1X = [1, shape_1X]
 
-        if y is None:
-            for k in range(n_mgsRF):
-                prf = getattr(self, '_mgsprf_{}_{}'.format(window,k))
-                crf = getattr(self, '_mgscrf_{}_{}'.format(window,k))
-                pred_prob_prf = prf.predict_proba(sliced_X)
-                pred_prob_crf = crf.predict_proba(sliced_X)
+        return shape_1X, getattr(self, 'window', None) or [shape_1X[1]]
 
-                if k == 0:
-                    pred_prob = np.c_[pred_prob_prf, pred_prob_crf]
-                else:
-                    pred_prob = np.concatenate((pred_prob, pred_prob_prf, pred_prob_crf), axis=1)
+    def _window_grid(self, X, window, shape_1X):
+        """ Layout of the windows of a sample.
 
-        return pred_prob.reshape([getattr(self, '_n_samples'), -1])
+        :return: tuple and int
+            Shape of the grid of windows ([n_windows] for sequences, [n_windows_x, n_windows_y]
+            for images) and number of values of a window.
+        """
+        if shape_1X[0] > 1:
+            sliced_X, _ = self._window_slicing_img(np.asarray(X[:1]), window, shape_1X, stride=getattr(self, 'stride'))
+            return sliced_X.shape[1:3], window**2
+
+        sliced_X, _ = self._window_slicing_sequence(np.asarray(X[:1]), window, shape_1X, stride=getattr(self, 'stride'))
+        return sliced_X.shape[1:2], window
+
+    def _mgs_window_subsample(self, y, n_windows, window):
+        """ Stratified subsample of the windows used to train the Multi Grain Scanning forests.
+        Each class gets a share of mgs_max_windows proportional to its number of samples.
+
+        :param y: np.array
+            Target values of the samples.
+
+        :param n_windows: int
+            Number of windows of a sample.
+
+        :param window: int
+            Window size (used to derive the seed).
+
+        :return: np.array or None
+            Sorted flat indices (sample * n_windows + window) of the selected windows,
+            'None' if all the windows are used.
+        """
+        max_windows = getattr(self, 'mgs_max_windows', None)
+        y = np.asarray(y)
+        if max_windows is None or max_windows >= len(y) * n_windows:
+            return None
+
+        seed = self._random_seed(_MGS_SUBSAMPLE_SEED, window)
+        rng = np.random.default_rng(np.random.randint(2**31) if seed is None else seed)
+        selected = []
+        for c in np.unique(y):
+            samples = np.flatnonzero(y == c)
+            n_select = min(len(samples) * n_windows, max(1, max_windows * len(samples) // len(y)))
+            flat = rng.choice(len(samples) * n_windows, n_select, replace=False)
+            selected.append(samples[flat // n_windows] * n_windows + flat % n_windows)
+
+        return np.sort(np.concatenate(selected))
 
     def _window_slicing_img(self, X, window, shape_1X, y=None, stride=1):
         """ Slicing procedure for images
@@ -264,22 +497,19 @@ class gcForest(object):
             Step used when slicing the data.
 
         :return: np.array and np.array
-            Arrays containing the sliced images and target values (empty if 'y' is None).
+            Strided view of shape [n_samples, n_windows_x, n_windows_y, window, window] on X
+            containing the sliced images (no copy is made) and target values (empty if 'y' is None).
         """
         if any(s < window for s in shape_1X):
             raise ValueError('window must be smaller than both dimensions for an image')
 
         len_iter_x = np.floor_divide((shape_1X[1] - window), stride) + 1
         len_iter_y = np.floor_divide((shape_1X[0] - window), stride) + 1
-        iterx_array = np.arange(0, stride*len_iter_x, stride)
-        itery_array = np.arange(0, stride*len_iter_y, stride)
-
-        ref_row = np.arange(0, window)
-        ref_ind = np.ravel([ref_row + shape_1X[1] * i for i in range(window)])
-        inds_to_take = [ref_ind + ix + shape_1X[1] * iy
-                        for ix, iy in itertools.product(iterx_array, itery_array)]
 
-        sliced_imgs = np.take(X, inds_to_take, axis=1).reshape(-1, window**2)
+        imgs = np.asarray(X)[:, :shape_1X[0] * shape_1X[1]].reshape(-1, shape_1X[0], shape_1X[1])
+        # [n_samples, y, x, window, window], the windows are then ordered x first.
+        sliced_imgs = sliding_window_view(imgs, (window, window), axis=(1, 2))[:, ::stride, ::stride]
+        sliced_imgs = np.swapaxes(sliced_imgs, 1, 2)
 
         if y is not None:
             sliced_target = np.repeat(y, len_iter_x * len_iter_y)
@@ -308,17 +538,16 @@ class gcForest(object):
             Step used when slicing the data.
 
         :return: np.array and np.array
-            Arrays containing the sliced sequences and target values (empty if 'y' is None).
+            Strided view of shape [n_samples, n_windows, window] on X containing the
+            sliced sequences (no copy is made) and target values (empty if 'y' is None).
         """
         if shape_1X[1] < window:
             raise ValueError('window must be smaller than the sequence dimension')
 
         len_iter = np.floor_divide((shape_1X[1] - window), stride) + 1
-        iter_array = np.arange(0, stride*len_iter, stride)
 
-        ind_1X = np.arange(np.prod(shape_1X))
-        inds_to_take = [ind_1X[i:i+window] for i in iter_array]
-        sliced_sqce = np.take(X, inds_to_take, axis=1).reshape(-1, window)
+        sqce = np.asarray(X)[:, :np.prod(shape_1X)]
+        sliced_sqce = sliding_window_view(sqce, window, axis=1)[:, ::stride]
 
         if y is not None:
             sliced_target = np.repeat(y, len_iter)
@@ -344,90 +573,150 @@ class gcForest(object):
         n_cascadeRF = getattr(self, 'n_cascadeRF')
         
         if y is not None:
-            setattr(self, 'n_layer', 0)
-            test_size = getattr(self, 'cascade_test_size')
             max_layers = getattr(self, 'max_cascade_layer')
             min_layers = getattr(self, 'min_cascade_layer')
             tol = getattr(self, 'tolerance')
-            
-            X_train, X_test, y_train, y_test = train_test_split(X, y, stratify = y, test_size=test_size)
 
-            self.n_layer += 1
-            prf_crf_pred_ref = self._cascade_layer(X_train, y_train)
-            accuracy_ref = self._cascade_evaluation(X_test, y_test)
-            feat_arr = X_train
-            
+            growth = self.grow_cascade(X, y)
+            for accuracy_ref, accuracy_layer, prf_crf_pred_ref in growth:
+                if not ((accuracy_layer > (accuracy_ref + tol) or self.n_layer <= min_layers) and self.n_layer <= max_layers):
+                    break
+            growth.close()
+
+            if accuracy_layer <= accuracy_ref :
+                self._drop_last_layer()
+
+        elif y is None:
+            forward_state = {}
+            for at_layer in range(1, getattr(self, 'n_layer') + 1):
+                prf_crf_pred_ref = self._cascade_forward(X, at_layer, forward_state)
+
+        return prf_crf_pred_ref
+
+    def grow_cascade(self, X, y):
+        """ Train the cascade layer by layer.
+        Generator training the first two layers on the first iteration and one more layer
+        on each following one, it never stops nor removes a layer by itself: cascade_forest
+        stops it with the min_cascade_layer / max_cascade_layer / tolerance rule, a caller
+        can also pause it between layers and resume it later to add layers to the model
+        without training the previous ones again (see search.successive_halving).
+
+        :param X: np.array
+            Array containing the input samples.
+            Must be of shape [n_samples, data] where data is a 1D array.
+
+        :param y: np.array
+            Target values.
+
+        :return: generator
+            Yields, after each new layer, the accuracy of the previous layer, the accuracy
+            of the new layer and the class vectors of the previous layer.
+        """
+        version = getattr(self, 'version')
+        setattr(self, 'n_layer', 0)
+        self._clear_packed('_packed_cascade')
+        test_size = getattr(self, 'cascade_test_size')
+
+        growth = getattr(self, 'cascade_growth', 'split')
+        if growth not in ('split', 'oob'):
+            raise ValueError("cascade_growth must be 'split' or 'oob'")
+
+        if growth == 'oob':
+            X_train, y_train = X, y
+        else:
+            X_train, X_test, y_train, y_test = train_test_split(X, y, stratify = y, test_size=test_size,
+                                                                random_state=self._random_seed(_SPLIT_SEED))
+        eval_state, train_state = {}, {}
+
+        setattr(self, 'layer_report', [])
+        setattr(self, '_n_cascade_features', X_train.shape[1])
+
+        def evaluate(prf_crf_pred):
+            if growth == 'oob':
+                accuracy = self._oob_evaluation(prf_crf_pred, y_train)
+            else:
+                accuracy = self._cascade_evaluation(X_test, y_test, eval_state)
+            self.layer_report[-1]['accuracy'] = accuracy
+            return accuracy
+
+        self.n_layer += 1
+        prf_crf_pred_ref = self._cascade_layer(X_train, y_train, state=train_state)
+        accuracy_ref = evaluate(prf_crf_pred_ref)
+        feat_arr = X_train
+
+        while True:
             if version == 1:
-                feature_importance = []
-                for irf in range(n_cascadeRF):
-                    prf = getattr(self, '_casprf{}_{}'.format(self.n_layer, irf))
-                    crf = getattr(self, '_cascrf{}_{}'.format(self.n_layer, irf))
-                    feature_importance.append(prf.feature_importances_+crf.feature_importances_)
-                index = np.argsort(np.sum(feature_importance,axis=0))[::-1][:int(X_train.shape[1])]
-                setattr(self, '_inedx_{}'.format(self.n_layer),index)
-                feat_arr = X_train[:,index]
-                feat_arr = np.concatenate((feat_arr, getattr(self, '_add_feat_train{}'.format(self.n_layer))), axis=1)
+                feat_arr = self._next_layer_input(feat_arr, self.n_layer, train_state['add_feat'], train_state)
 
             if version == 0:
-                feat_arr = self._create_feat_arr(X_train, prf_crf_pred_ref)
+                feat_arr = self._create_feat_arr(X_train, prf_crf_pred_ref, train_state)
 
             self.n_layer += 1
-            prf_crf_pred_layer = self._cascade_layer(feat_arr, y_train)
-            accuracy_layer = self._cascade_evaluation(X_test, y_test)
+            prf_crf_pred_layer = self._cascade_layer(feat_arr, y_train, state=train_state)
+            accuracy_layer = evaluate(prf_crf_pred_layer)
+            yield accuracy_ref, accuracy_layer, prf_crf_pred_ref
 
-            while (accuracy_layer > (accuracy_ref + tol) or self.n_layer <= min_layers) and self.n_layer <= max_layers:
-                accuracy_ref = accuracy_layer
-                prf_crf_pred_ref = prf_crf_pred_layer
-                
-                if version == 1:
-                    feature_importance = []
-                    for irf in range(n_cascadeRF):
-                        prf = getattr(self, '_casprf{}_{}'.format(self.n_layer, irf))
-                        crf = getattr(self, '_cascrf{}_{}'.format(self.n_layer, irf))
-                        feature_importance.append(prf.feature_importances_+crf.feature_importances_)
-                    index = np.argsort(np.sum(feature_importance,axis=0))[::-1][:int(X_train.shape[1])]
-                    setattr(self, '_inedx_{}'.format(self.n_layer),index)
-                    feat_arr = feat_arr[:,index]
-                    feat_arr = np.concatenate((feat_arr, getattr(self, '_add_feat_train{}'.format(self.n_layer))), axis=1)
-
-                if version == 0:
-                    feat_arr = self._create_feat_arr(X_train, prf_crf_pred_ref)
-                    
-                self.n_layer += 1
-                prf_crf_pred_layer = self._cascade_layer(feat_arr, y_train)
-                accuracy_layer = self._cascade_evaluation(X_test, y_test)
+            accuracy_ref = accuracy_layer
+            prf_crf_pred_ref = prf_crf_pred_layer
 
-            if accuracy_layer <= accuracy_ref :
-                n_cascadeRF = getattr(self, 'n_cascadeRF')
-                for irf in range(n_cascadeRF):
-                    delattr(self, '_casprf{}_{}'.format(self.n_layer, irf))
-                    delattr(self, '_cascrf{}_{}'.format(self.n_layer, irf))
-                self.n_layer -= 1
+    def _drop_last_layer(self):
+        """ Remove the last trained layer of the cascade (it did not improve the accuracy). """
+        n_cascadeRF = getattr(self, 'n_cascadeRF')
+        names = []
+        for irf in range(n_cascadeRF):
+            names.append('_casprf{}_{}'.format(self.n_layer, irf))
+            names.append('_cascrf{}_{}'.format(self.n_layer, irf))
+        if getattr(self, 'version') == 1:
+            names.extend('_casclf{}_{}'.format(self.n_layer, c) for c in range(getattr(self, 'num_classes')))
+            names.extend(name.format(self.n_layer) for name in ('_casclf_1{}', '_casclf_2{}', '_inedx_{}', '_index_{}'))
+        names.append('_packed_cascade{}'.format(self.n_layer))
+        for name in names:
+            if hasattr(self, name):
+                delattr(self, name)
+
+        layer_report = getattr(self, 'layer_report', None)
+        if layer_report and layer_report[-1]['layer'] == self.n_layer:
+            layer_report.pop()
+        self.n_layer -= 1
+
+    def _cascade_forward(self, X, at_layer, state):
+        """ Send the samples through a single trained cascade layer.
+        The layer input is built from the outputs of the previous layer stored in 'state',
+        which is then updated in place so that the next layer can be computed without
+        going through the previous ones again.
 
-        elif y is None:
-            at_layer = 1
-            prf_crf_pred_ref = self._cascade_layer(X, layer=at_layer)
-            while at_layer < getattr(self, 'n_layer'):
-                at_layer += 1
-                
-                if version == 1:
-                    if at_layer > 2:
-                        index = getattr(self, '_inedx_{}'.format(at_layer-1))
-                        feat_arr = feat_arr[:,index]
-                        feat_arr = np.concatenate((feat_arr, getattr(self, '_add_feat_test{}'.format(at_layer-1))), axis=1)
-                    else:
-                        index = getattr(self, '_inedx_{}'.format(at_layer-1))
-                        feat_arr = X[:,index]
-                        feat_arr = np.concatenate((feat_arr, getattr(self, '_add_feat_test{}'.format(at_layer-1))), axis=1)
-                
-                if version == 0:
-                    feat_arr = self._create_feat_arr(X, prf_crf_pred_ref)
-                    
-                prf_crf_pred_ref = self._cascade_layer(feat_arr, layer=at_layer)
+        :param X: np.array
+            Array containing the input samples.
+            Must be of shape [n_samples, data] where data is a 1D array.
 
-        return prf_crf_pred_ref
+        :param at_layer: int
+            Layer indice. Layers must be visited in increasing order starting from 1.
+
+        :param state: dict
+            Outputs of layer 'at_layer-1' for X (empty when at_layer=1). All the
+            intermediate arrays of a prediction live there, never on the model.
+
+        :return: list
+            List containing the prediction probabilities for all samples.
+        """
+        version = getattr(self, 'version')
+
+        if at_layer == 1:
+            feat_arr = X
+        elif version == 1:
+            feat_arr = self._next_layer_input(state['feat_arr'], at_layer-1, state['add_feat'], state)
+        else:
+            feat_arr = self._create_feat_arr(X, state['prf_crf_pred'], state)
+
+        prf_crf_pred = self._cascade_layer(feat_arr, layer=at_layer, state=state)
+        state['feat_arr'] = feat_arr
+        state['prf_crf_pred'] = prf_crf_pred
 
-    def _cascade_layer(self, X, y=None, layer=0):
+        return prf_crf_pred
+
+    @profiled('cascade_layer', lambda self, X, y=None, layer=0, state=None:
+              {'layer': self.n_layer if y is not None else layer, 'training': y is not None, 'input': X})
+    def _cascade_layer(self, X, y=None, layer=0, state=None):
         """ Cascade layer containing Random Forest estimators.
         If y is not None the layer is trained.
 
@@ -441,6 +730,10 @@ class gcForest(object):
         :param layer: int (default=0)
             Layer indice. Used to call the previously trained layer.
 
+        :param state: dict (default=None)
+            Forward state of the cascade. The class vectors of the improved deep forest
+            passed on to the next layer are stored in it as 'add_feat' (list of arrays).
+
         :return: list
             List containing the prediction probabilities for all samples.
         """
@@ -448,85 +741,258 @@ class gcForest(object):
         n_cascadeRF = getattr(self, 'n_cascadeRF')
         min_samples = getattr(self, 'min_samples_cascade')
 
-        n_jobs = getattr(self, 'n_jobs')
-        prf = RandomForestClassifier(n_estimators=n_tree, max_features='sqrt',
-                                     oob_score=True, n_jobs=n_jobs)
-        crf = RandomForestClassifier(n_estimators=n_tree, max_features='sqrt',
-                                     oob_score=True, n_jobs=n_jobs)
+        version = getattr(self, 'version')
     
         prf_crf_pred = []
         if y is not None:
-            print('Adding/Training Layer, n_layer={}'.format(self.n_layer))
+            logger.info('Adding/Training Layer, n_layer={}'.format(self.n_layer))
+            tic = time.perf_counter()
+            # Single float32 copy of X shared by all the forests of the layer.
+            X_fit = np.ascontiguousarray(X, dtype=np.float32)
+            fit_tasks = []
             for irf in range(n_cascadeRF):
-                prf.fit(X, y)
-                crf.fit(X, y)
+                prf = self._random_forest(n_tree, 'sqrt', self._random_seed(_CASCADE_SEED, self.n_layer, len(fit_tasks)))
+                crf = self._random_forest(n_tree, 'sqrt', self._random_seed(_CASCADE_SEED, self.n_layer, len(fit_tasks)+1))
                 setattr(self, '_casprf{}_{}'.format(self.n_layer, irf), prf)
                 setattr(self, '_cascrf{}_{}'.format(self.n_layer, irf), crf)
-                prf_crf_pred.append(prf.oob_decision_function_)
-                prf_crf_pred.append(crf.oob_decision_function_)
-        elif y is None:
+                fit_tasks.append((prf, X_fit, y, None))
+                fit_tasks.append((crf, X_fit, y, None))
+
+            if version == 1:
+                num_classes = len(np.unique(y))
+                setattr(self, 'num_classes', num_classes)
+
+                for c in range(num_classes):
+                    weight = np.ones(len(y))
+                    index = np.where(y==c)
+                    weight[index] = 32
+                    clf = self._random_forest(2*n_tree//num_classes, 'sqrt',
+                                              self._random_seed(_CASCADE_SEED, self.n_layer, len(fit_tasks)))
+                    setattr(self, '_casclf{}_{}'.format(self.n_layer, c), clf)
+                    fit_tasks.append((clf, X_fit, y, weight))
+
+                clf_1 = self._random_forest(n_tree, 'sqrt', self._random_seed(_CASCADE_SEED, self.n_layer, len(fit_tasks)))
+                setattr(self, '_casclf_1{}'.format(self.n_layer), clf_1)
+                fit_tasks.append((clf_1, X_fit, y, None))
+
+            self._fit_forests(fit_tasks)
             for irf in range(n_cascadeRF):
-                prf = getattr(self, '_casprf{}_{}'.format(layer, irf))
-                crf = getattr(self, '_cascrf{}_{}'.format(layer, irf))
-                prf_crf_pred.append(prf.predict_proba(X))
-                prf_crf_pred.append(crf.predict_proba(X))
-        
-        version = getattr(self, 'version')
+                prf_crf_pred.append(getattr(self, '_casprf{}_{}'.format(self.n_layer, irf)).oob_decision_function_)
+                prf_crf_pred.append(getattr(self, '_cascrf{}_{}'.format(self.n_layer, irf)).oob_decision_function_)
+        elif y is None:
+            layer_pred = self._layer_ensemble(layer).predict_proba(X)
+            prf_crf_pred = layer_pred[:2*n_cascadeRF]
         
         if y is not None and version == 1:
-            new_X = X.copy()
-            num_classes = len(np.unique(y))
-            setattr(self, 'num_classes', num_classes)
-            
+            # Columns passed on to the next layer, ranked by the importances of prf and crf.
+            feature_importance = []
+            for irf in range(n_cascadeRF):
+                prf = getattr(self, '_casprf{}_{}'.format(self.n_layer, irf))
+                crf = getattr(self, '_cascrf{}_{}'.format(self.n_layer, irf))
+                feature_importance.append(prf.feature_importances_+crf.feature_importances_)
+            n_keep = getattr(self, 'max_layer_features', None) or getattr(self, '_n_cascade_features', X.shape[1])
+            setattr(self, '_inedx_{}'.format(self.n_layer), np.argsort(np.sum(feature_importance,axis=0))[::-1][:int(n_keep)])
+
+            add_feat = []
             for c in range(num_classes):
-                weight = np.ones(len(y))
-                index = np.where(y==c)
-                weight[index] = 32
-                clf = RandomForestClassifier(n_estimators=2*n_tree//num_classes, oob_score=True, max_features='sqrt', n_jobs=n_jobs)
-                clf.fit(X, y, sample_weight=weight)
-                setattr(self, '_casclf{}_{}'.format(self.n_layer, c), clf)
-                new_X = np.concatenate((new_X, clf.oob_decision_function_), axis=1)
-            
-            clf_1 = RandomForestClassifier(n_estimators=n_tree, oob_score=True, max_features='sqrt', n_jobs=n_jobs)
-            clf_1.fit(X, y)
+                clf = getattr(self, '_casclf{}_{}'.format(self.n_layer, c))
+                add_feat.append(clf.oob_decision_function_)
             
             tmp = clf_1.feature_importances_
             sq = int(np.sqrt(X.shape[1]))
             index = np.argsort(tmp)[::-1][sq//2:-sq//2]
 
             setattr(self, '_index_{}'.format(self.n_layer), index)
-            X_ = X[:,index]
-            clf_2 = RandomForestClassifier(n_estimators=n_tree, oob_score=True, max_features='sqrt', n_jobs=n_jobs)
-            clf_2.fit(X_, y)
+            clf_2 = self._random_forest(n_tree, 'sqrt', self._random_seed(_CASCADE_SEED, self.n_layer, len(fit_tasks)))
+            self._fit_forests([(clf_2, X_fit[:,index], y, None)])
 
-            new_X = np.concatenate((new_X, clf_1.oob_decision_function_), axis=1)
-            new_X = np.concatenate((new_X, clf_2.oob_decision_function_), axis=1)
-            setattr(self, '_casclf_1{}'.format(self.n_layer), clf_1)
+            add_feat.append(clf_1.oob_decision_function_)
+            add_feat.append(clf_2.oob_decision_function_)
             setattr(self, '_casclf_2{}'.format(self.n_layer), clf_2)
 
-            setattr(self, '_add_feat_train{}'.format(self.n_layer), new_X[:,-num_classes*2-num_classes**2:])
+            if state is not None:
+                state['add_feat'] = add_feat
 
                 
-        elif y is None and version == 1:
-            new_X = X.copy()
-            num_classes = getattr(self, 'num_classes')
-
-            for c in range(num_classes):
-                clf = getattr(self, '_casclf{}_{}'.format(layer, c))
-                new_X = np.concatenate((new_X, clf.predict_proba(X)), axis=1)
-                
-            clf_1 = getattr(self, '_casclf_1{}'.format(layer))
-            clf_2 = getattr(self, '_casclf_2{}'.format(layer))
-            new_X = np.concatenate((new_X, clf_1.predict_proba(X)), axis=1)
-            X_ = X[:,getattr(self, '_index_{}'.format(layer))]
-            new_X = np.concatenate((new_X, clf_2.predict_proba(X_)), axis=1)
-            setattr(self, '_add_feat_test{}'.format(layer), new_X[:,-num_classes*2-num_classes**2:])
+        elif y is None and version == 1 and state is not None:
+            # Per class forests, clf_1 and clf_2 outputs, in this order.
+            state['add_feat'] = layer_pred[2*n_cascadeRF:]
 
+        if y is not None:
+            self.layer_report.append({'layer': self.n_layer, 'n_features': X.shape[1],
+                                      'fit_time': time.perf_counter() - tic})
 
         return prf_crf_pred
 
-    def _cascade_evaluation(self, X_test, y_test):
+    def _next_layer_input(self, feat_arr, layer, add_feat, state):
+        """ Input of the layer following 'layer' in the improved deep forest: the columns
+        '_inedx_' of the input of 'layer' followed by its class vectors. It is written in
+        one of the two layer buffers of 'state', the other one holding the input of
+        'layer', so that the cascade never allocates more than two layer inputs.
+
+        :param feat_arr: np.array
+            Input of the layer.
+
+        :param layer: int
+            Layer indice.
+
+        :param add_feat: list
+            Class vectors of the per class forests, clf_1 and clf_2 of the layer.
+
+        :param state: dict
+            Forward state of the cascade holding the buffers.
+
+        :return: np.array
+            Array of shape [n_samples, len(_inedx_) + n_class_vector_columns] (float32).
+        """
+        index = getattr(self, '_inedx_{}'.format(layer))
+        width = len(index) + sum(np.shape(feat)[1] for feat in add_feat)
+        new_feat_arr = self._layer_buffer(state, feat_arr.shape[0], width)
+        np.take(feat_arr, index, axis=1, out=new_feat_arr[:, :len(index)], mode='clip')
+        col = len(index)
+        for feat in add_feat:
+            new_feat_arr[:, col:col + np.shape(feat)[1]] = feat
+            col += np.shape(feat)[1]
+
+        return new_feat_arr
+
+    def _layer_buffer(self, state, n_samples, width):
+        """ C-contiguous float32 array of shape [n_samples, width] in the layer buffers of
+        'state', the two buffers being used alternately (a buffer is only reallocated
+        when a layer input is wider than it).
+        """
+        buffers = state.setdefault('buffers', [np.empty(0, dtype=np.float32)] * 2)
+        i = state.get('next_buffer', 0)
+        if buffers[i].size < n_samples * width:
+            buffers[i] = np.empty(n_samples * width, dtype=np.float32)
+        state['next_buffer'] = 1 - i
+
+        return buffers[i][:n_samples * width].reshape(n_samples, width)
+
+    def _mgs_ensemble(self, window):
+        """ PackedEnsemble of the Multi Grain Scanning Random Forests of a window size
+        (built on first use).
+
+        :param window: int
+            Window size.
+
+        :return: PackedEnsemble
+            Forests in the order prf_0, crf_0, prf_1, crf_1, ..
+        """
+        ensemble = getattr(self, '_packed_mgs_{}'.format(window), None)
+        if ensemble is None:
+            forests = []
+            for k in range(getattr(self, 'n_mgsRF')):
+                forests.append(getattr(self, '_mgsprf_{}_{}'.format(window, k)))
+                forests.append(getattr(self, '_mgscrf_{}_{}'.format(window, k)))
+            ensemble = PackedEnsemble([_pack(rf) for rf in forests])
+            setattr(self, '_packed_mgs_{}'.format(window), ensemble)
+
+        return ensemble
+
+    def _layer_ensemble(self, layer):
+        """ PackedEnsemble of all the Random Forests of a cascade layer (built on first use).
+        clf_2 of the improved deep forest reads the columns '_index_' of the layer input
+        through its feature map, so the whole layer is evaluated in a single pass.
+
+        :param layer: int
+            Layer indice.
+
+        :return: PackedEnsemble
+            Forests in the order prf_0, crf_0, prf_1, crf_1, .. followed for version 1
+            by the per class forests, clf_1 and clf_2.
+        """
+        ensemble = getattr(self, '_packed_cascade{}'.format(layer), None)
+        if ensemble is None:
+            forests = []
+            for irf in range(getattr(self, 'n_cascadeRF')):
+                forests.append(getattr(self, '_casprf{}_{}'.format(layer, irf)))
+                forests.append(getattr(self, '_cascrf{}_{}'.format(layer, irf)))
+            feature_maps = [None] * len(forests)
+            if getattr(self, 'version') == 1:
+                for c in range(getattr(self, 'num_classes')):
+                    forests.append(getattr(self, '_casclf{}_{}'.format(layer, c)))
+                forests.append(getattr(self, '_casclf_1{}'.format(layer)))
+                forests.append(getattr(self, '_casclf_2{}'.format(layer)))
+                feature_maps += [None] * (len(forests) - len(feature_maps) - 1)
+                feature_maps.append(getattr(self, '_index_{}'.format(layer)))
+            ensemble = PackedEnsemble([_pack(rf) for rf in forests], feature_maps)
+            setattr(self, '_packed_cascade{}'.format(layer), ensemble)
+
+        return ensemble
+
+    def _random_seed(self, *key):
+        """ Seed of the random object identified by 'key', derived from random_state.
+
+        :param key: int
+            Integers identifying the object (kind, window size or layer, rank).
+
+        :return: int or None
+            None if random_state is 'None'.
+        """
+        random_state = getattr(self, 'random_state', None)
+        if random_state is None:
+            return None
+
+        return int(np.random.SeedSequence(random_state, spawn_key=key).generate_state(1)[0])
+
+    def _random_forest(self, n_estimators, max_features, random_state):
+        """ Unfitted Random Forest of the backend set by forest_backend, with out-of-bag
+        predictions (the class vectors of the training samples).
+
+        :param n_estimators: int
+            Number of trees.
+
+        :param max_features: int or str
+            Number of features drawn for each split.
+
+        :param random_state: int
+            Seed of the forest (see _random_seed).
+
+        :return: RandomForestClassifier or HistRandomForestClassifier
+        """
+        backend = getattr(self, 'forest_backend', 'exact')
+        n_jobs = getattr(self, 'n_jobs')
+        if backend == 'hist':
+            return HistRandomForestClassifier(n_estimators=n_estimators, max_features=max_features,
+                                              n_bins=getattr(self, 'forest_bins', 256), oob_score=True,
+                                              n_jobs=n_jobs, random_state=random_state)
+        if backend != 'exact':
+            raise ValueError("forest_backend must be 'exact' or 'hist'")
+
+        return RandomForestClassifier(n_estimators=n_estimators, max_features=max_features, oob_score=True,
+                                      n_jobs=n_jobs, random_state=random_state)
+
+    def _clear_packed(self, prefix='_packed_'):
+        """ Remove the PackedEnsemble instances whose attribute name starts with 'prefix'. """
+        for name in [name for name in vars(self) if name.startswith(prefix)]:
+            delattr(self, name)
+
+    def _fit_forests(self, fit_tasks):
+        """ Fit independent Random Forests concurrently.
+        Each forest is a task of a thread pool (tree building releases the GIL, so the
+        threads share the input arrays without copying them) and the cores left are
+        split between the trees of each forest.
+
+        :param fit_tasks: list
+            List of (forest, X, y, sample_weight) tuples, sample_weight can be None.
+        """
+        n_jobs = getattr(self, 'n_jobs')
+        n_cores = effective_n_jobs(n_jobs)
+        n_workers = min(n_cores, len(fit_tasks))
+
+        for rf, _, _, _ in fit_tasks:
+            rf.set_params(n_jobs=max(1, n_cores // n_workers))
+        Parallel(n_jobs=n_workers, prefer='threads')(
+            delayed(rf.fit)(X, y, sample_weight=sample_weight) for rf, X, y, sample_weight in fit_tasks)
+        for rf, _, _, _ in fit_tasks:
+            rf.set_params(n_jobs=n_jobs)
+
+    @profiled('cascade_evaluation', lambda self, X_test, y_test, eval_state: {'layer': self.n_layer, 'input': X_test})
+    def _cascade_evaluation(self, X_test, y_test, eval_state):
         """ Evaluate the accuracy of the cascade using X and y.
+        Only the last added layer is run, the outputs of the previous layers
+        for X_test are read from (and the new ones written to) 'eval_state'.
 
         :param X_test: np.array
             Array containing the test input samples.
@@ -535,19 +1001,43 @@ class gcForest(object):
         :param y_test: np.array
             Test target values.
 
+        :param eval_state: dict
+            Forward state of the cascade on X_test, see _cascade_forward.
+
         :return: float
             the cascade accuracy.
         """
-        casc_pred_prob = np.mean(self.cascade_forest(X_test), axis=0)
+        casc_pred_prob = np.mean(self._cascade_forward(X_test, self.n_layer, eval_state), axis=0)
         casc_pred = np.argmax(casc_pred_prob, axis=1)
         casc_accuracy = accuracy_score(y_true=y_test, y_pred=casc_pred)
-        print('Layer validation accuracy = {}'.format(casc_accuracy))
+        logger.info('Layer validation accuracy = {}'.format(casc_accuracy))
 
         return casc_accuracy
 
-    def _create_feat_arr(self, X, prf_crf_pred):
+    @profiled('cascade_evaluation', lambda self, prf_crf_pred, y: {'layer': self.n_layer, 'method': 'oob'})
+    def _oob_evaluation(self, prf_crf_pred, y):
+        """ Out-of-bag estimate of the accuracy of the last added layer.
+
+        :param prf_crf_pred: list
+            Out-of-bag class vectors of the forests of the layer for the training samples.
+
+        :param y: np.array
+            Training target values.
+
+        :return: float
+            the out-of-bag accuracy of the layer.
+        """
+        oob_pred = np.argmax(np.mean(prf_crf_pred, axis=0), axis=1)
+        oob_accuracy = accuracy_score(y_true=y, y_pred=oob_pred)
+        logger.info('Layer out-of-bag accuracy = {}'.format(oob_accuracy))
+
+        return oob_accuracy
+
+    def _create_feat_arr(self, X, prf_crf_pred, state):
         """ Concatenate the original feature vector with the predicition probabilities
-        of a cascade layer.
+        of a cascade layer. The result is a float32 buffer of 'state' (the forests work
+        on float32 anyway) reused by all the layers: the original features are copied
+        on first use, then only the probabilities are written in place.
 
         :param X: np.array
             Array containing the input samples.
@@ -556,12 +1046,31 @@ class gcForest(object):
         :param prf_crf_pred: list
             Prediction probabilities by a cascade layer for X.
 
+        :param state: dict
+            Forward state of the cascade holding the buffer.
+
         :return: np.array
-            Concatenation of X and the predicted probabilities.
+            Concatenation of the predicted probabilities and X.
             To be used for the next layer in a cascade forest.
         """
-        swap_pred = np.swapaxes(prf_crf_pred, 0, 1)
-        add_feat = swap_pred.reshape([np.shape(X)[0], -1])
-        feat_arr = np.concatenate([add_feat, X], axis=1)
+        n_classes = np.shape(prf_crf_pred[0])[1]
+        n_pred = len(prf_crf_pred) * n_classes
+        feat_arr = state.get('feat_buffer')
+        if feat_arr is None:
+            feat_arr = np.empty((np.shape(X)[0], n_pred + np.shape(X)[1]), dtype=np.float32)
+            feat_arr[:, n_pred:] = X
+            state['feat_buffer'] = feat_arr
+        for i, pred in enumerate(prf_crf_pred):
+            feat_arr[:, i * n_classes:(i + 1) * n_classes] = pred
 
         return feat_arr
+
+
+def _pack(forest):
+    """ PackedForest of a fitted Random Forest (returned as is if already packed). """
+    if isinstance(forest, PackedForest):
+        return forest
+    if isinstance(forest, HistRandomForestClassifier):
+        return forest.packed_
+
+    return PackedForest.from_forest(forest)
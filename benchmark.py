@@ -0,0 +1,360 @@
+#!usr/bin/env python
+# offline benchmarks of the loader, the feature pipeline and gcForest.
+#
+#   python benchmark.py run --scales 1 10 --output baseline.json
+#   python benchmark.py run --scales 1 10 --compare baseline.json
+#   python benchmark.py compare baseline.json current.json
+
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+import numpy as np
+import scipy
+import sklearn
+from scipy.signal import sosfilt
+from sklearn.model_selection import train_test_split
+
+from GCForest import gcForest
+from features import psd_lbp_features
+from loader import load_archive
+from preprocessing import bandpass_filter, butter_bandpass_sos
+from profiling import peak_rss, reset_peak_rss
+
+# Size of the archive when the bundled data is not available.
+DEFAULT_N_RECORDINGS = 132
+DEFAULT_N_POINTS = 5000
+
+# Multi Grain Scanning (window, stride) pairs run on the 770 PSD+LBP columns.
+MGS_WINDOWS = ((64, 32), (128, 64))
+
+# Parameters of the benchmarked cascades, the number of layers is fixed so that
+# the timings of two runs are comparable.
+CASCADE_PARAMS = {'n_mgsRF': -1, 'window': [20], 'n_cascadeRF': 2, 'n_cascadeRFtree': 50,
+                  'min_cascade_layer': 3, 'max_cascade_layer': 3, 'random_state': 0}
+
+
+def synthetic_archive(n_recordings, n_points=DEFAULT_N_POINTS, n_channels=2, fs=1000, path=None,
+                      random_state=0, chunk_size=256):
+    """ Synthetic multi-channel sEMG recordings with two classes.
+    Each recording is band-limited Gaussian noise modulated by a periodic muscle activation
+    envelope, class 1 recordings have a lower frequency band (spectral shift).
+
+    :param n_recordings: int
+        Number of recordings.
+
+    :param n_points: int (default=5000)
+        Length of the recordings.
+
+    :param n_channels: int (default=2)
+        Number of channels.
+
+    :param fs: float (default=1000)
+        Sampling frequency in Hz.
+
+    :param path: str (default=None)
+        .npy file the recordings are written to (chunk by chunk) and read from if it
+        already exists. If 'None' the recordings are generated in memory.
+
+    :param random_state: int (default=0)
+        Seed of the generator.
+
+    :param chunk_size: int (default=256)
+        Number of recordings generated at once.
+
+    :return: np.array and np.array
+        float32 array of shape [n_recordings, n_channels, n_points] (memory-mapped if
+        'path' is given) and the labels of shape [n_recordings].
+    """
+    rng = np.random.default_rng(random_state)
+    labels = rng.integers(0, 2, n_recordings)
+    if path is not None and os.path.exists(path):
+        return np.load(path, mmap_mode='r'), labels
+
+    shape = (n_recordings, n_channels, n_points)
+    if path is None:
+        signals = np.empty(shape, dtype=np.float32)
+    else:
+        signals = np.lib.format.open_memmap(path + '.tmp.npy', mode='w+', dtype=np.float32, shape=shape)
+
+    bands = [np.array(butter_bandpass_sos(30, 200, fs, 4)), np.array(butter_bandpass_sos(20, 120, fs, 4))]
+    t = np.arange(n_points) / fs
+    for start in range(0, n_recordings, chunk_size):
+        stop = min(start + chunk_size, n_recordings)
+        y = labels[start:stop, None, None]
+        noise = rng.standard_normal((stop - start, n_channels, n_points))
+        x = np.where(y == 1, sosfilt(bands[1], noise, axis=-1), sosfilt(bands[0], noise, axis=-1))
+        period = rng.uniform(1.5, 3., (stop - start, 1, 1))
+        phase = rng.uniform(0, 2 * np.pi, (stop - start, 1, 1))
+        envelope = 0.15 + (0.5 + 0.5 * np.sin(2 * np.pi * t / period + phase))**4
+        gain = rng.lognormal(0, 0.3, (stop - start, n_channels, 1))
+        signals[start:stop] = gain * envelope * x
+
+    if path is not None:
+        signals.flush()
+        del signals
+        os.replace(path + '.tmp.npy', path)
+        signals = np.load(path, mmap_mode='r')
+
+    return signals, labels
+
+
+def measure(func, repeat=3, memory=True):
+    """ Time a function (best of 'repeat' calls) and measure its peak memory.
+    The memory is the growth of the peak resident set size of the process during the
+    first call. Where the peak cannot be reset (not Linux), an extra call is made under
+    tracemalloc (numpy and python allocations only).
+
+    :param func: function
+        Function without arguments.
+
+    :param repeat: int (default=3)
+        Number of timed calls.
+
+    :param memory: bool (default=True)
+        If False, the memory is not measured.
+
+    :return: dict
+        'wall_time' (best), 'wall_times' (all), 'peak_memory' (bytes, or None).
+    """
+    peak_memory = None
+    rss_peak = memory and reset_peak_rss() and peak_rss()
+    times = []
+    for _ in range(max(1, repeat)):
+        tic = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - tic)
+        if rss_peak:
+            peak_memory, rss_peak = peak_rss() - rss_peak, None
+
+    if memory and peak_memory is None:
+        tracemalloc.start()
+        try:
+            func()
+            peak_memory = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    return {'wall_time': min(times), 'wall_times': times, 'peak_memory': peak_memory}
+
+
+def run_benchmarks(scales=(1, 10), data_dir='data', work_dir='benchmark_data', repeat=3,
+                   mgs_windows=MGS_WINDOWS, verbose=True):
+    """ Run all the benchmarks.
+    Scale 1 is the bundled archive, scale s > 1 is a synthetic archive of s times as many
+    recordings (of the median length of the archive), stored in work_dir.
+
+    :param scales: list (default=(1, 10))
+        Data scales to run.
+
+    :param data_dir: str (default='data')
+        Root directory of the bundled archive.
+
+    :param work_dir: str (default='benchmark_data')
+        Directory of the synthetic archives and of the loader cache.
+
+    :param repeat: int (default=3)
+        Number of timed calls of each benchmark.
+
+    :param mgs_windows: list (default=MGS_WINDOWS)
+        (window, stride) pairs of the Multi Grain Scanning benchmarks.
+
+    :param verbose: bool (default=True)
+        If True, each result is printed when available.
+
+    :return: dict
+        {'meta': environment, 'results': {name: record}}.
+    """
+    os.makedirs(work_dir, exist_ok=True)
+    results = {}
+
+    def record(case, scale, n_samples, metrics):
+        name = '{}/x{}'.format(case, scale)
+        results[name] = dict(metrics, case=case, scale=scale, n_samples=n_samples)
+        if verbose:
+            print('{:<40} {:>10.4f} s {:>12} {}'.format(name, metrics['wall_time'], _format_bytes(metrics['peak_memory']),
+                                                       '' if 'accuracy' not in metrics else
+                                                       'accuracy {:.4f}'.format(metrics['accuracy'])))
+
+    archive = None
+    if os.path.isdir(data_dir):
+        archive = load_archive(data_dir, cache_dir=os.path.join(work_dir, 'cache'))
+        n_recordings = len(archive)
+        n_points = int(np.median(np.diff(archive.offsets)))
+        record('load_archive_cold', 1, n_recordings,
+               measure(lambda: load_archive(data_dir, use_cache=False), repeat=1))
+        record('load_archive_cached', 1, n_recordings,
+               measure(lambda: load_archive(data_dir, cache_dir=os.path.join(work_dir, 'cache')), repeat))
+    else:
+        n_recordings, n_points = DEFAULT_N_RECORDINGS, DEFAULT_N_POINTS
+
+    for scale in scales:
+        if scale == 1 and archive is not None:
+            recordings, labels = archive.recordings(), archive.labels
+            batches = [recordings]
+        else:
+            path = os.path.join(work_dir, 'synthetic_{}x2x{}.npy'.format(scale * n_recordings, n_points))
+            recordings, labels = synthetic_archive(scale * n_recordings, n_points, path=path)
+            batches = [recordings[i:i + 256] for i in range(0, len(recordings), 256)]
+        n = len(labels)
+
+        record('bandpass_filter', scale, n, measure(lambda: [bandpass_filter(b) for b in batches], repeat))
+        metrics = measure(lambda: [psd_lbp_features(b) for b in batches], repeat)
+        record('psd_lbp_features', scale, n, metrics)
+        metrics = measure(lambda: [psd_lbp_features(b, compact=True) for b in batches], repeat)
+        record('psd_lbp_features[compact]', scale, n, metrics)
+
+        X = np.nan_to_num(np.concatenate([psd_lbp_features(b) for b in batches], axis=0))
+        X_train, X_test, y_train, y_test = train_test_split(X, labels, test_size=0.2, stratify=labels,
+                                                            random_state=0)
+        # Compact (float32) features of the same split, given to gcForest as they are.
+        X_compact = np.nan_to_num(np.concatenate([psd_lbp_features(b, compact=True) for b in batches], axis=0))
+        X_compact_train, X_compact_test = train_test_split(X_compact, test_size=0.2, stratify=labels, random_state=0)
+
+        for window, stride in mgs_windows:
+            case = 'mg_scanning[w={},s={}]'.format(window, stride)
+            model = gcForest(shape_1X=X.shape[1], window=[window], stride=stride, n_mgsRF=1,
+                             n_mgsRFtree=30, random_state=0)
+            record(case + '_fit', scale, len(X_train), measure(lambda: model.mg_scanning(X_train, y_train), 1))
+            record(case + '_transform', scale, len(X_test), measure(lambda: model.mg_scanning(X_test), repeat))
+            model = gcForest(shape_1X=X.shape[1], window=[window], stride=stride, n_mgsRF=1,
+                             n_mgsRFtree=30, forest_backend='hist', random_state=0)
+            record(case + '_fit[hist]', scale, len(X_train), measure(lambda: model.mg_scanning(X_train, y_train), 1))
+
+        for version in (0, 1):
+            model = gcForest(shape_1X=X.shape[1], version=version, cascade_growth='oob', **CASCADE_PARAMS)
+            record('cascade_fit[v{},oob]'.format(version), scale, len(X_train),
+                   measure(lambda: model.fit(X_train, y_train), 1))
+            model = gcForest(shape_1X=X.shape[1], version=version, **CASCADE_PARAMS)
+            metrics = measure(lambda: model.fit(X_train, y_train), 1)
+            metrics['accuracy'] = float(np.mean(model.predict(X_test) == y_test))
+            record('cascade_fit[v{}]'.format(version), scale, len(X_train), metrics)
+            model.compile()
+            record('predict_batch[v{}]'.format(version), scale, len(X_test),
+                   measure(lambda: model.predict(X_test), repeat))
+            n_single = min(20, len(X_test))
+            metrics = measure(lambda: [model.predict(X_test[i:i + 1]) for i in range(n_single)], repeat)
+            metrics['wall_time'] /= n_single
+            metrics['wall_times'] = [t / n_single for t in metrics['wall_times']]
+            record('predict_single[v{}]'.format(version), scale, 1, metrics)
+
+            # Same cascade with the histogram forests and/or on the compact features, the
+            # accuracies on the test set tell what they cost.
+            for tag, backend, X_fit, X_eval in (('hist', 'hist', X_train, X_test),
+                                                ('compact', 'exact', X_compact_train, X_compact_test),
+                                                ('compact,hist', 'hist', X_compact_train, X_compact_test)):
+                model = gcForest(shape_1X=X.shape[1], version=version, forest_backend=backend, **CASCADE_PARAMS)
+                metrics = measure(lambda: model.fit(X_fit, y_train), 1)
+                metrics['accuracy'] = float(np.mean(model.predict(X_eval) == y_test))
+                record('cascade_fit[v{},{}]'.format(version, tag), scale, len(X_train), metrics)
+
+    meta = {'date': time.strftime('%Y-%m-%dT%H:%M:%S'), 'python': platform.python_version(),
+            'numpy': np.__version__, 'scipy': scipy.__version__, 'sklearn': sklearn.__version__,
+            'machine': platform.machine(), 'cpu_count': os.cpu_count(), 'repeat': repeat}
+
+    return {'meta': meta, 'results': results}
+
+
+def compare(baseline, current, threshold=0.2, min_time=0.005, min_memory=1 << 20):
+    """ Compare two benchmark runs.
+    A benchmark regresses when its time (or peak memory) grows by more than 'threshold'
+    and by more than the noise floor min_time (or min_memory).
+
+    :param baseline: dict
+        Output of run_benchmarks used as reference.
+
+    :param current: dict
+        Output of run_benchmarks to check.
+
+    :param threshold: float (default=0.2)
+        Relative growth allowed.
+
+    :param min_time: float (default=0.005)
+        Time differences below this (seconds) are ignored.
+
+    :param min_memory: int (default=1 << 20)
+        Memory differences below this (bytes) are ignored.
+
+    :return: list
+        List of (name, metric, baseline value, current value, ratio, regressed) tuples
+        for the benchmarks present in both runs.
+    """
+    rows = []
+    for name in sorted(set(baseline['results']) & set(current['results'])):
+        base, cur = baseline['results'][name], current['results'][name]
+        for metric, floor in (('wall_time', min_time), ('peak_memory', min_memory)):
+            if base.get(metric) is None or cur.get(metric) is None:
+                continue
+            ratio = cur[metric] / base[metric] if base[metric] else np.inf
+            regressed = cur[metric] > base[metric] * (1 + threshold) and cur[metric] - base[metric] > floor
+            rows.append((name, metric, base[metric], cur[metric], ratio, bool(regressed)))
+
+    return rows
+
+
+def print_comparison(rows):
+    """ Print the output of compare, return the number of regressions. """
+    for name, metric, base, cur, ratio, regressed in rows:
+        if metric == 'wall_time':
+            base, cur = '{:.4f} s'.format(base), '{:.4f} s'.format(cur)
+        else:
+            base, cur = _format_bytes(base), _format_bytes(cur)
+        print('{:<40} {:<12} {:>12} {:>12} {:>7.2f}x {}'.format(name, metric, base, cur, ratio,
+                                                                 'REGRESSION' if regressed else ''))
+    n_regressions = sum(row[-1] for row in rows)
+    print('{} regression(s)'.format(n_regressions))
+
+    return n_regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Offline benchmarks of the sEMG pipeline and gcForest.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run = subparsers.add_parser('run', help='run the benchmarks')
+    run.add_argument('--scales', type=int, nargs='+', default=[1, 10],
+                     help='data scales, 1 is the bundled archive (e.g. 1 10 100 1000)')
+    run.add_argument('--repeat', type=int, default=3, help='timed calls per benchmark')
+    run.add_argument('--data-dir', default='data')
+    run.add_argument('--work-dir', default='benchmark_data', help='synthetic data and cache directory')
+    run.add_argument('--output', default='benchmark_results.json')
+    run.add_argument('--compare', metavar='BASELINE', help='baseline to compare the results with')
+    run.add_argument('--threshold', type=float, default=0.2)
+
+    cmp = subparsers.add_parser('compare', help='compare two result files')
+    cmp.add_argument('baseline')
+    cmp.add_argument('current')
+    cmp.add_argument('--threshold', type=float, default=0.2)
+
+    args = parser.parse_args(argv)
+    if args.command == 'run':
+        current = run_benchmarks(args.scales, args.data_dir, args.work_dir, args.repeat)
+        with open(args.output, 'w') as f:
+            json.dump(current, f, indent=1)
+        if args.compare is None:
+            return 0
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    else:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        with open(args.current) as f:
+            current = json.load(f)
+
+    return 1 if print_comparison(compare(baseline, current, args.threshold)) else 0
+
+
+def _format_bytes(n):
+    if n is None:
+        return '-'
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if n < 1024 or unit == 'GB':
+            return '{:.1f} {}'.format(n, unit)
+        n /= 1024.
+
+
+if __name__ == '__main__':
+    sys.exit(main())
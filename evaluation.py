@@ -0,0 +1,238 @@
+#!usr/bin/env python
+# repeated K-fold evaluation of classifiers on a feature matrix, run on a process pool.
+
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.metrics import accuracy_score
+from sklearn.model_selection import KFold, StratifiedGroupKFold
+from sklearn.neighbors import KNeighborsClassifier
+from sklearn.neural_network import MLPClassifier
+from sklearn.svm import SVC
+
+from GCForest import gcForest
+from profiling import peak_rss, reset_peak_rss
+
+# Models of the notebook, as name: (estimator class, parameters). Every job fits a new
+# instance, the estimators run single threaded since the jobs already use all the cores.
+MODELS = {'rf': (RandomForestClassifier, {'n_estimators': 200, 'n_jobs': 1}),
+          'knn': (KNeighborsClassifier, {'n_neighbors': 1}),
+          'svm': (SVC, {'kernel': 'rbf'}),
+          'mlp': (MLPClassifier, {'solver': 'lbfgs', 'alpha': 1e-5, 'hidden_layer_sizes': (64, 32), 'random_state': 1}),
+          'gcf': (gcForest, {'window': [20], 'stride': 20, 'tolerance': 0, 'n_mgsRF': -1, 'n_cascadeRF': 1,
+                             'n_cascadeRFtree': 200, 'min_cascade_layer': 2, 'max_cascade_layer': 8,
+                             'version': 0, 'n_jobs': 1}),
+          'gcf_v1': (gcForest, {'window': [20], 'stride': 20, 'tolerance': 0, 'n_mgsRF': -1, 'n_cascadeRF': 1,
+                                'n_cascadeRFtree': 200, 'min_cascade_layer': 2, 'max_cascade_layer': 8,
+                                'version': 1, 'n_jobs': 1})}
+
+# Version of the job records, records of other versions in a results file are not reused
+# (version 1 timed the jobs under tracemalloc).
+RECORD_VERSION = 2
+
+# Features and targets of the worker process, set by _init_worker.
+_shared = {}
+
+
+def run_evaluation(X, y, models=None, n_repeats=5, n_splits=5, results_path='results.jsonl',
+                   features_path=None, n_workers=None, random_state=0, groups=None):
+    """ Repeated K-fold evaluation of several models.
+    Every (repeat, fold, model) is an independent job of a process pool. The features are
+    saved once as a .npy file that the workers memory-map, only the fold indices are sent
+    to them. Each finished job is appended to the results file (JSON lines) with the test
+    predictions, the fit and predict times and the growth of the peak resident memory of
+    the worker during the job.
+    Jobs already in the results file for the same data, folds and model parameters are
+    not run again, so an interrupted sweep is resumed by calling the function again.
+
+    :param X: np.array or str
+        Array of shape [n_samples, n_features], or path of a .npy file containing it.
+
+    :param y: np.array
+        1D array containing the target values.
+
+    :param models: dict (default=None)
+        Models to evaluate as name: (estimator class, parameters).
+        If 'None' the models of the notebook (MODELS) are used.
+
+    :param n_repeats: int (default=5)
+        Number of repetitions of the K-fold.
+
+    :param n_splits: int (default=5)
+        Number of folds.
+
+    :param results_path: str (default='results.jsonl')
+        Results file, created or appended to.
+
+    :param features_path: str (default=None)
+        Where X is saved for the workers when it is an array.
+        If 'None', '<results_path without extension>_features.npy' is used.
+
+    :param n_workers: int (default=None)
+        Number of worker processes. If 'None' the number of cores is used.
+        If 1 the jobs are run in the current process.
+
+    :param random_state: int (default=0)
+        Seed of the shuffling of the folds, repeat r uses random_state + r.
+
+    :param groups: np.array (default=None)
+        Group of each sample (e.g. the subject of segmentation.segment_archive windows).
+        If given, the folds are stratified and grouped: all the samples of a group are in
+        the same fold, so a patient is never both in the train and the test set.
+
+    :return: list
+        Records of all the jobs of the sweep (loaded and new ones).
+    """
+    if models is None:
+        models = MODELS
+    y = np.asarray(y)
+
+    if isinstance(X, str):
+        features_path = X
+    else:
+        if features_path is None:
+            features_path = os.path.splitext(results_path)[0] + '_features.npy'
+        np.save(features_path, np.asarray(X))
+    X = np.load(features_path, mmap_mode='r')
+    if X.shape[0] != len(y):
+        raise ValueError('Sizes of y and X do not match.')
+
+    if groups is None:
+        data_key = _fingerprint(np.asarray(X), y, n_splits, random_state)
+    else:
+        groups = np.asarray(groups)
+        if len(groups) != len(y):
+            raise ValueError('Sizes of groups and y do not match.')
+        data_key = _fingerprint(np.asarray(X), y, n_splits, random_state, groups)
+    jobs = []
+    for repeat in range(n_repeats):
+        if groups is None:
+            kf = KFold(n_splits=n_splits, shuffle=True, random_state=random_state + repeat)
+        else:
+            kf = StratifiedGroupKFold(n_splits=n_splits, shuffle=True, random_state=random_state + repeat)
+        for fold, (train_index, test_index) in enumerate(kf.split(X, y, groups)):
+            for name, (estimator, params) in models.items():
+                key = '{}/{}'.format(data_key, _fingerprint(RECORD_VERSION, estimator.__name__,
+                                                            sorted(params.items(), key=str)))
+                jobs.append({'key': key, 'repeat': repeat, 'fold': fold, 'model': name,
+                             'train_index': train_index, 'test_index': test_index,
+                             'estimator': estimator, 'params': params})
+
+    records = load_results(results_path)
+    done = {(r['key'], r['repeat'], r['fold'], r['model']): r for r in records}
+    todo = [job for job in jobs if (job['key'], job['repeat'], job['fold'], job['model']) not in done]
+
+    with open(results_path, 'a') as f:
+        if n_workers == 1:
+            _init_worker(features_path, y)
+            finished = (_run_job(job) for job in todo)
+        else:
+            pool = ProcessPoolExecutor(max_workers=n_workers, initializer=_init_worker, initargs=(features_path, y))
+            finished = (future.result() for future in as_completed([pool.submit(_run_job, job) for job in todo]))
+        try:
+            for record in finished:
+                f.write(json.dumps(record) + '\n')
+                f.flush()
+                done[(record['key'], record['repeat'], record['fold'], record['model'])] = record
+        finally:
+            if n_workers != 1:
+                pool.shutdown(cancel_futures=True)
+
+    return [done[(job['key'], job['repeat'], job['fold'], job['model'])] for job in jobs]
+
+
+def load_results(results_path):
+    """ Records of a results file (an unterminated last line is ignored).
+
+    :param results_path: str
+        Results file written by run_evaluation.
+
+    :return: list
+        List of dict, one per finished job.
+    """
+    records = []
+    if os.path.exists(results_path):
+        with open(results_path) as f:
+            for line in f:
+                if line.endswith('\n'):
+                    records.append(json.loads(line))
+
+    return records
+
+
+def summarize(records):
+    """ Mean and standard deviation of the accuracy and of the times of each model.
+
+    :param records: list
+        Records returned by run_evaluation or load_results.
+
+    :return: dict
+        name: {'accuracy', 'accuracy_std', 'fit_time', 'predict_time', 'peak_memory', 'n_folds'}.
+    """
+    summary = {}
+    for name in sorted(set(r['model'] for r in records)):
+        model_records = [r for r in records if r['model'] == name]
+        accuracy = [r['accuracy'] for r in model_records]
+        summary[name] = {'accuracy': float(np.mean(accuracy)),
+                         'accuracy_std': float(np.std(accuracy)),
+                         'fit_time': float(np.mean([r['fit_time'] for r in model_records])),
+                         'predict_time': float(np.mean([r['predict_time'] for r in model_records])),
+                         'peak_memory': max([r['peak_memory'] for r in model_records
+                                             if r.get('peak_memory') is not None] or [None]),
+                         'n_folds': len(model_records)}
+
+    return summary
+
+
+def _init_worker(features_path, y):
+    """ Memory-map the features in the worker process. """
+    _shared['X'] = np.load(features_path, mmap_mode='r')
+    _shared['y'] = y
+
+
+def _run_job(job):
+    """ Fit and evaluate a model on one fold.
+
+    :param job: dict
+        Job built by run_evaluation.
+
+    :return: dict
+        Record of the job ('peak_memory' is the growth of the peak resident set size of
+        the process during the job in bytes, 'None' where the peak cannot be reset).
+    """
+    X, y = _shared['X'], _shared['y']
+    train_index, test_index = job['train_index'], job['test_index']
+
+    # Not tracemalloc, which slows the forest fits down several times.
+    rss_start = reset_peak_rss() and peak_rss()
+    tic = time.perf_counter()
+    estimator = job['estimator'](**job['params'])
+    estimator.fit(np.nan_to_num(X[train_index]), y[train_index])
+    fit_time = time.perf_counter() - tic
+
+    tic = time.perf_counter()
+    y_pred = estimator.predict(np.nan_to_num(X[test_index]))
+    predict_time = time.perf_counter() - tic
+    peak_memory = peak_rss() - rss_start if rss_start else None
+
+    return {'key': job['key'], 'repeat': job['repeat'], 'fold': job['fold'], 'model': job['model'],
+            'accuracy': float(accuracy_score(y[test_index], y_pred)),
+            'fit_time': fit_time, 'predict_time': predict_time, 'peak_memory': peak_memory,
+            'test_index': test_index.tolist(), 'y_pred': np.asarray(y_pred).tolist()}
+
+
+def _fingerprint(*values):
+    """ Short hash identifying arrays and python values. """
+    h = hashlib.sha1()
+    for value in values:
+        if isinstance(value, np.ndarray):
+            h.update(str((value.shape, value.dtype.str)).encode())
+            h.update(np.ascontiguousarray(value).tobytes())
+        else:
+            h.update(repr(value).encode())
+
+    return h.hexdigest()[:16]
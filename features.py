@@ -0,0 +1,364 @@
+#!usr/bin/env python
+# vectorised feature extraction for multi-channel sEMG recordings.
+
+import functools
+import numpy as np
+from scipy.signal import welch
+from scipy.stats import skew, kurtosis
+
+TIME_DOMAIN_FEATURES = ('RMS', 'MAV', 'IEMG', 'ZC', 'SSC', 'WL', 'SKEW', 'KURTOSIS', 'VAR', 'MPF', 'MF')
+
+LBP_METHODS = ('default', 'uniform', 'ri', 'riu2')
+
+
+def rms(x):
+    """ Root mean square of the signals along the last axis. """
+    return np.sqrt(np.mean(x**2, axis=-1))
+
+
+def mav(x):
+    """ Mean absolute value of the signals along the last axis. """
+    return np.mean(np.abs(x), axis=-1)
+
+
+def iemg(x):
+    """ Integrated EMG of the signals along the last axis. """
+    return np.sum(np.abs(x), axis=-1)
+
+
+def zc(x):
+    """ Number of zero crossings of the signals along the last axis. """
+    return np.count_nonzero(x[..., :-1] * x[..., 1:] < 0, axis=-1)
+
+
+def ssc(x):
+    """ Number of slope sign changes of the signals along the last axis. """
+    center, left, right = x[..., 1:-1], x[..., :-2], x[..., 2:]
+    peak = (center < right) & (center < left)
+    valley = (center > right) & (center > left)
+    return np.count_nonzero(peak | valley, axis=-1)
+
+
+def wl(x):
+    """ Waveform length of the signals along the last axis.
+    The absolute differences are accumulated sequentially, as a plain python sum does.
+    """
+    return np.add.accumulate(np.abs(x[..., :-1] - x[..., 1:]), axis=-1)[..., -1]
+
+
+def var(x):
+    """ Energy of the signals along the last axis (sum of the squared values). """
+    return np.sum(x**2, axis=-1)
+
+
+def psd_values(x, fs=1000):
+    """ Power spectral density of the signals along the last axis (Welch method).
+
+    :param x: np.array
+        Array of shape [.., n_points] containing the signals.
+
+    :param fs: float (default=1000)
+        Sampling frequency of the signals.
+
+    :return: np.array and np.array
+        Frequencies and PSD of shape [.., n_freqs].
+    """
+    return welch(x, fs=fs, axis=-1)
+
+
+def mpf(f, psd):
+    """ Mean power frequency of power spectral densities of shape [.., n_freqs]. """
+    rows = psd.reshape(-1, psd.shape[-1])
+    res = np.array([np.dot(f, row) for row in rows]) / np.sum(rows, axis=-1)
+    return res.reshape(psd.shape[:-1])
+
+
+def mf(f, psd):
+    """ Median frequency of power spectral densities of shape [.., n_freqs]. """
+    half = np.sum(psd, axis=-1) / 2
+    reached = np.cumsum(psd, axis=-1) >= half[..., None]
+    res = f[np.argmax(reached, axis=-1)]
+    return np.where(np.any(reached, axis=-1), res, np.nan)
+
+
+def lbp_codes(x, neighborhood=4):
+    """ 1D local binary pattern codes of the signals along the last axis.
+    Bit j of a code is set when the j-th neighbour (the 'neighborhood' left neighbours
+    followed by the 'neighborhood' right ones) is greater or equal to the center.
+
+    :param x: np.array
+        Array of shape [.., n_points] containing the signals.
+
+    :param neighborhood: int (default=4)
+        Number of neighbours taken on each side of the center.
+
+    :return: np.array
+        Array of shape [.., n_points - 2*neighborhood] containing the codes, of the
+        smallest unsigned integer type holding 2*neighborhood bits (uint8 for 4).
+    """
+    n_codes = x.shape[-1] - 2 * neighborhood
+    center = x[..., neighborhood:neighborhood + n_codes]
+    offsets = list(range(neighborhood)) + list(range(neighborhood + 1, 2 * neighborhood + 1))
+    dtype = _code_dtype(2 * neighborhood)
+
+    codes = np.zeros(center.shape, dtype=dtype)
+    for bit, offset in enumerate(offsets):
+        codes |= (x[..., offset:offset + n_codes] >= center).astype(dtype) << bit
+    return codes
+
+
+def lbp_codes_multiscale(x, neighborhoods=(3, 4, 5, 6)):
+    """ 1D local binary pattern codes of the signals for several neighbourhood sizes in a
+    single pass. The comparison of every point with its neighbours at distance d is done
+    once, on shifted views of the signals, and packed into the codes of all the
+    neighbourhoods using it. Codes are the same as those of lbp_codes.
+
+    :param x: np.array
+        Array of shape [.., n_points] containing the signals.
+
+    :param neighborhoods: list (default=(3, 4, 5, 6))
+        Numbers of neighbours taken on each side of the center.
+
+    :return: dict
+        neighborhood: array of shape [.., n_points - 2*neighborhood] containing the codes,
+        of the smallest unsigned integer type holding 2*neighborhood bits.
+    """
+    neighborhoods = sorted(set(int(n) for n in neighborhoods))
+    n_points = x.shape[-1]
+    if n_points <= 2 * neighborhoods[-1]:
+        raise ValueError('signals must be longer than 2*neighborhood points')
+
+    codes = {n: np.zeros(x.shape[:-1] + (n_points - 2 * n,), dtype=_code_dtype(2 * n)) for n in neighborhoods}
+    for d in range(1, neighborhoods[-1] + 1):
+        # left[..., k]: x[k] >= x[k+d] (neighbour d points before center k+d),
+        # right[..., k]: x[k+d] >= x[k] (neighbour d points after center k).
+        left = x[..., :n_points - d] >= x[..., d:]
+        right = x[..., d:] >= x[..., :n_points - d]
+        for n in neighborhoods[np.searchsorted(neighborhoods, d):]:
+            n_codes, dtype = codes[n].shape[-1], codes[n].dtype
+            codes[n] |= left[..., n - d:n - d + n_codes].astype(dtype) << (n - d)
+            codes[n] |= right[..., n:n + n_codes].astype(dtype) << (n + d - 1)
+
+    return codes
+
+
+@functools.lru_cache(maxsize=None)
+def lbp_mapping(neighborhood=4, method='default'):
+    """ Lookup table from the LBP codes to the histogram bins.
+    The 2*neighborhood bits of a code are read as a circular pattern, as in 2D LBP.
+    'default' keeps every code, 'uniform' gives a bin to every pattern with at most two
+    0/1 transitions and a single bin to all the other ones, 'ri' merges the circular
+    rotations of a pattern (rotation invariant) and 'riu2' maps the uniform patterns to
+    their number of ones and the other ones to a last bin.
+
+    :param neighborhood: int (default=4)
+        Number of neighbours taken on each side of the center.
+
+    :param method: str (default='default')
+        One of LBP_METHODS.
+
+    :return: np.array and int
+        Read-only array of shape [2**(2*neighborhood)] containing the bin of each code,
+        and number of bins.
+    """
+    n_bits = 2 * neighborhood
+    codes = np.arange(1 << n_bits)
+    if method == 'default':
+        bins, n_bins = codes, 1 << n_bits
+    elif method in LBP_METHODS:
+        bits = (codes[:, None] >> np.arange(n_bits)) & 1
+        uniform = np.count_nonzero(bits != np.roll(bits, 1, axis=1), axis=1) <= 2
+        if method == 'uniform':
+            bins = np.where(uniform, np.cumsum(uniform) - 1, np.count_nonzero(uniform))
+            n_bins = np.count_nonzero(uniform) + 1
+        elif method == 'ri':
+            mask = (1 << n_bits) - 1
+            smallest = np.min([((codes >> r) | (codes << (n_bits - r))) & mask for r in range(n_bits)], axis=0)
+            _, bins = np.unique(smallest, return_inverse=True)
+            n_bins = int(bins.max()) + 1
+        else:
+            bins = np.where(uniform, bits.sum(axis=1), n_bits + 1)
+            n_bins = n_bits + 2
+    else:
+        raise ValueError('method must be one of {}'.format(LBP_METHODS))
+
+    bins = bins.astype(np.intp)
+    bins.setflags(write=False)
+    return bins, int(n_bins)
+
+
+def lbp_hist(x, neighborhood=4, method='default', dtype=np.float64):
+    """ 1D local binary pattern histogram of the signals along the last axis.
+
+    :param x: np.array
+        Array of shape [.., n_points] containing the signals.
+
+    :param neighborhood: int (default=4)
+        Number of neighbours taken on each side of the center.
+
+    :param method: str (default='default')
+        Reduction of the codes, see lbp_mapping.
+
+    :param dtype: dtype (default=np.float64)
+        Type of the counts, e.g. np.uint16 for a compact histogram.
+
+    :return: np.array
+        Array of shape [.., n_bins] containing the code counts
+        (2**(2*neighborhood) bins for 'default').
+    """
+    return _code_hist(lbp_codes(x, neighborhood), neighborhood, method, dtype)
+
+
+def lbp_hist_multiscale(x, neighborhoods=(3, 4, 5, 6), method='riu2', dtype=np.float64):
+    """ 1D local binary pattern histograms of the signals for several neighbourhood sizes,
+    the codes being computed in a single pass (see lbp_codes_multiscale).
+
+    :param x: np.array
+        Array of shape [.., n_points] containing the signals.
+
+    :param neighborhoods: list (default=(3, 4, 5, 6))
+        Numbers of neighbours taken on each side of the center.
+
+    :param method: str (default='riu2')
+        Reduction of the codes, see lbp_mapping.
+
+    :param dtype: dtype (default=np.float64)
+        Type of the counts.
+
+    :return: np.array
+        Array of shape [.., n_bins] containing the histograms of every neighbourhood
+        size, in the order of 'neighborhoods'.
+    """
+    codes = lbp_codes_multiscale(x, neighborhoods)
+    return np.concatenate([_code_hist(codes[n], n, method, dtype) for n in neighborhoods], axis=-1)
+
+
+def _code_hist(codes, neighborhood, method, dtype=np.float64):
+    """ Histograms of LBP codes of shape [.., n_codes] over the bins of lbp_mapping. """
+    if np.issubdtype(dtype, np.integer) and codes.shape[-1] > np.iinfo(dtype).max:
+        raise ValueError('{} codes per histogram do not fit in {}'.format(codes.shape[-1], np.dtype(dtype).name))
+    bins, n_bins = lbp_mapping(neighborhood, method)
+    rows = codes.reshape(-1, codes.shape[-1])
+    if method != 'default':
+        rows = bins[rows]
+    offset = np.arange(len(rows))[:, None] * n_bins
+    hist = np.bincount((rows + offset).ravel(), minlength=len(rows) * n_bins)
+    return hist.reshape(codes.shape[:-1] + (n_bins,)).astype(dtype)
+
+
+def _code_dtype(n_bits):
+    """ Smallest unsigned integer type holding n_bits bits. """
+    for dtype in (np.uint8, np.uint16, np.uint32, np.uint64):
+        if n_bits <= np.iinfo(dtype).bits:
+            return dtype
+    raise ValueError('at most 64 bits per code')
+
+
+def time_domain_features(recordings, fs=1000):
+    """ Time and frequency domain features of each recording.
+    For every channel: RMS, MAV, IEMG, ZC, SSC, WL, skewness, kurtosis, VAR, MPF and MF,
+    preceded by a constant zero column (1 + 11*n_channels columns, 23 for two channels).
+
+    :param recordings: np.array or list
+        Array of shape [n_recordings, n_channels, n_points] or list of
+        [n_channels, n_points] arrays (recordings can have different lengths).
+
+    :param fs: float (default=1000)
+        Sampling frequency of the recordings.
+
+    :return: np.array
+        Array of shape [n_recordings, 1 + 11*n_channels] containing the features.
+    """
+    feature = []
+    for x in _iter_batches(recordings):
+        f, psd = psd_values(x, fs)
+        feats = [rms(x), mav(x), iemg(x), zc(x), ssc(x), wl(x),
+                 _per_channel(skew, x), _per_channel(kurtosis, x), var(x), mpf(f, psd), mf(f, psd)]
+        # [n, n_channels, n_features] -> channel 0 features first.
+        feats = np.stack(feats, axis=-1).reshape(len(x), -1)
+        feature.append(np.concatenate((np.zeros((len(x), 1)), feats), axis=1))
+
+    return np.concatenate(feature, axis=0)
+
+
+def _per_channel(func, x):
+    """ func applied to every 1D channel of x of shape [n, n_channels, n_points]
+    (scipy.stats moments along an axis of a batch can differ from them in the last bit).
+    """
+    return np.array([[func(channel) for channel in recording] for recording in x]).reshape(x.shape[:-1])
+
+
+def psd_lbp_features(recordings, fs=1000, neighborhood=4, method='default', compact=False):
+    """ PSD and 1D-LBP histogram features of each recording.
+    The last two points of each recording are dropped, the PSD is computed on the
+    signal scaled by 100. Columns are the PSD of every channel followed by the LBP
+    histogram of every channel (770 columns for two channels).
+
+    :param recordings: np.array or list
+        Array of shape [n_recordings, n_channels, n_points] or list of
+        [n_channels, n_points] arrays (recordings can have different lengths).
+
+    :param fs: float (default=1000)
+        Sampling frequency of the recordings.
+
+    :param neighborhood: int (default=4)
+        Number of neighbours taken on each side of the center for the LBP.
+
+    :param method: str (default='default')
+        Reduction of the LBP codes, see lbp_mapping.
+
+    :param compact: bool (default=False)
+        If True the features are float32 instead of float64 (half the memory). The LBP
+        counts are exact (below 2**24), gcForest trains its forests on float32 anyway.
+
+    :return: np.array
+        Array of shape [n_recordings, n_channels*(n_freqs + n_bins)]
+        (2**(2*neighborhood) LBP bins for 'default').
+    """
+    dtype = np.float32 if compact else np.float64
+    feature = []
+    for x in _iter_batches(recordings):
+        x = x[..., :-2]
+        psd = psd_values(100 * x, fs)[1].reshape(len(x), -1)
+        hist = lbp_hist(x, neighborhood, method, dtype=dtype).reshape(len(x), -1)
+        feature.append(np.concatenate((psd.astype(dtype), hist), axis=1))
+
+    return np.concatenate(feature, axis=0)
+
+
+def multiscale_lbp_features(recordings, neighborhoods=(3, 4, 5, 6), method='riu2', dtype=np.float64):
+    """ Multi-scale 1D-LBP histogram features of each recording.
+    Columns are, for every channel, the histograms of every neighbourhood size.
+
+    :param recordings: np.array or list
+        Array of shape [n_recordings, n_channels, n_points] or list of
+        [n_channels, n_points] arrays (recordings can have different lengths).
+
+    :param neighborhoods: list (default=(3, 4, 5, 6))
+        Numbers of neighbours taken on each side of the center.
+
+    :param method: str (default='riu2')
+        Reduction of the codes, see lbp_mapping.
+
+    :param dtype: dtype (default=np.float64)
+        Type of the counts, e.g. np.uint16 (recordings up to 65535 points).
+
+    :return: np.array
+        Array of shape [n_recordings, n_channels*n_bins].
+    """
+    feature = []
+    for x in _iter_batches(recordings):
+        feature.append(lbp_hist_multiscale(x, neighborhoods, method, dtype).reshape(len(x), -1))
+
+    return np.concatenate(feature, axis=0)
+
+
+def _iter_batches(recordings):
+    """ Yield C-contiguous float64 batches of shape [n, n_channels, n_points].
+    A 3D array is a single batch, a list is yielded recording by recording.
+    """
+    if isinstance(recordings, np.ndarray) and recordings.ndim == 3:
+        yield np.ascontiguousarray(recordings, dtype=np.float64)
+    else:
+        for x in recordings:
+            yield np.ascontiguousarray(x, dtype=np.float64)[None]
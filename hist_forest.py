@@ -0,0 +1,478 @@
+#!usr/bin/env python
+# random forest grown on the histograms of binned features.
+
+import warnings
+
+import numpy as np
+
+from packed_forest import NODE_DTYPE, PackedForest
+
+# Nodes with at least _HIST_MIN_RATIO samples per bin find their split in the class
+# histograms of the bins of their features, smaller ones sort their (feature, bin)
+# entries instead (both give the same split, a histogram costs as many cells as there
+# are bins whatever the node size).
+_HIST_MIN_RATIO = 1
+# Maximum number of (sample, feature) entries evaluated at once.
+_MAX_ENTRIES = 1 << 16
+
+
+def bin_features(X, n_bins=256, block=256):
+    """ Quantile bins of the columns of X (computed on float32 values, the type the packed
+    forests compare). The edges are the distinct midpoints between the values around each
+    quantile, padded with +inf for columns with fewer distinct values. The bin of a value
+    is the number of edges of its column strictly below it, so that 'bin <= k' is
+    equivalent to 'value <= edges[k]'. NaN values fall in the last bin.
+
+    :param X: np.array
+        Array of shape [n_samples, n_features].
+
+    :param n_bins: int (default=256)
+        Maximum number of bins of a feature, from 2 to 256.
+
+    :param block: int (default=256)
+        Number of columns sorted at once.
+
+    :return: np.array and np.array
+        uint8 array of shape [n_samples, n_features] containing the bins and float32
+        array of shape [n_bins - 1, n_features] containing the edges.
+    """
+    if not 2 <= n_bins <= 256:
+        raise ValueError('n_bins must be between 2 and 256')
+    n_samples, n_features = np.shape(X)
+    rank = np.clip((np.arange(1, n_bins) * n_samples) // n_bins, 1, max(1, n_samples - 1))
+    edges = np.full((n_bins - 1, n_features), np.inf, dtype=np.float32)
+    codes = np.empty((n_samples, n_features), dtype=np.uint8)
+    for start in range(0, n_features, block):
+        stop = min(start + block, n_features)
+        values = np.asarray(X[:, start:stop], dtype=np.float32)
+        if n_samples > 1:
+            values_sorted = np.sort(values, axis=0).astype(np.float64)
+            with np.errstate(invalid='ignore', over='ignore'):
+                mid = ((values_sorted[rank - 1] + values_sorted[rank]) / 2).astype(np.float32)
+            mid[np.isnan(mid)] = np.inf
+        for j in range(start, stop):
+            if n_samples > 1:
+                distinct = np.unique(mid[:, j - start])
+                edges[:len(distinct), j] = distinct
+            codes[:, j] = np.searchsorted(edges[:, j], values[:, j - start], side='left')
+
+    return codes, edges
+
+
+class HistRandomForestClassifier(object):
+
+    def __init__(self, n_estimators=100, max_features='sqrt', n_bins=256, max_depth=None, min_samples_leaf=1,
+                 bootstrap=True, oob_score=False, random_state=None, n_jobs=None):
+        """ Random Forest classifier grown on the quantile bins of the features (see
+        bin_features), an alternative to sklearn's RandomForestClassifier for the forests
+        of gcForest. All the trees are grown together, one level per step: the best gini
+        split of a node is searched among max_features features drawn at random (drawn
+        again if they are all constant in the node) and among the bin boundaries only.
+        The split bins are mapped back to feature values, the fitted forest is a
+        PackedForest ('packed_') predicting on the features themselves. NaN values are
+        treated as larger than any value.
+
+        :param n_estimators: int (default=100)
+            Number of trees.
+
+        :param max_features: int, float, str or None (default='sqrt')
+            Number of features drawn for each split, as in sklearn ('sqrt', 'log2', an
+            int, a fraction of the features or 'None' for all).
+
+        :param n_bins: int (default=256)
+            Maximum number of bins of a feature, at most 256.
+
+        :param max_depth: int (default=None)
+            Maximum depth of the trees. If 'None' the nodes are split until they are pure.
+
+        :param min_samples_leaf: int (default=1)
+            Minimum number of distinct samples in a leaf.
+
+        :param bootstrap: bool (default=True)
+            Whether the trees are grown on bootstrap samples.
+
+        :param oob_score: bool (default=False)
+            Whether to compute the out-of-bag class probabilities
+            (oob_decision_function_) and accuracy (oob_score_).
+
+        :param random_state: int (default=None)
+            Seed of the bootstrap samples and feature draws.
+
+        :param n_jobs: int (default=None)
+            Not used, the trees are grown by vectorised NumPy operations in the calling
+            thread (kept so the forest can replace a RandomForestClassifier).
+        """
+        setattr(self, 'n_estimators', int(n_estimators))
+        setattr(self, 'max_features', max_features)
+        setattr(self, 'n_bins', int(n_bins))
+        setattr(self, 'max_depth', max_depth)
+        setattr(self, 'min_samples_leaf', int(min_samples_leaf))
+        setattr(self, 'bootstrap', bootstrap)
+        setattr(self, 'oob_score', oob_score)
+        setattr(self, 'random_state', random_state)
+        setattr(self, 'n_jobs', n_jobs)
+
+    def set_params(self, **params):
+        """ Set the parameters of the forest (as sklearn estimators). """
+        for name, value in params.items():
+            setattr(self, name, value)
+
+        return self
+
+    def fit(self, X, y, sample_weight=None):
+        """ Grow the forest.
+
+        :param X: np.array
+            Array of shape [n_samples, n_features], e.g. float32 or compact integer features.
+
+        :param y: np.array
+            1D array containing the target values.
+
+        :param sample_weight: np.array (default=None)
+            Weights of the samples, multiplied by their bootstrap counts.
+
+        :return: HistRandomForestClassifier
+            The fitted forest.
+        """
+        X = np.asarray(X)
+        n_samples, n_features = X.shape
+        codes, edges = bin_features(X, self.n_bins)
+        classes, y_index = np.unique(y, return_inverse=True)
+        rng = np.random.default_rng(self.random_state)
+        if sample_weight is None:
+            sample_weight = np.ones(n_samples)
+        sample_weight = np.asarray(sample_weight, dtype=np.float64)
+
+        # Weight of the samples in each tree: bootstrap count times sample weight.
+        bag_weight = np.ones((self.n_estimators, n_samples))
+        if self.bootstrap:
+            for tree in range(self.n_estimators):
+                bag_weight[tree] = np.bincount(rng.integers(0, n_samples, n_samples), minlength=n_samples)
+        in_bag = bag_weight > 0
+        bag_weight *= sample_weight
+
+        n_sub = _n_sub_features(self.max_features, n_features)
+        tree, value, feature, split_bin, left = _grow_forest(codes, y_index, len(classes), bag_weight, n_sub,
+                                                             self.max_depth, self.min_samples_leaf, rng)
+        del bag_weight
+        inner = left >= 0
+        weighted_n = value.sum(axis=1)
+        impurity = 1.0 - np.sum((value / weighted_n[:, np.newaxis]) ** 2, axis=1)
+
+        # Mean decrease of impurity, as RandomForestClassifier.feature_importances_.
+        left_child = left[inner]
+        decrease = (weighted_n[inner] * impurity[inner] - weighted_n[left_child] * impurity[left_child]
+                    - weighted_n[left_child + 1] * impurity[left_child + 1])
+        tree_importances = np.bincount(tree[inner] * n_features + feature[inner], weights=decrease,
+                                       minlength=self.n_estimators * n_features).reshape(self.n_estimators, n_features)
+        grown = inner[:self.n_estimators]
+        importances = np.zeros(n_features)
+        if grown.any():
+            tree_importances = tree_importances[grown]
+            totals = tree_importances.sum(axis=1, keepdims=True)
+            importances = np.mean(tree_importances / np.where(totals > 0, totals, 1.0), axis=0)
+            if importances.sum() > 0:
+                importances /= importances.sum()
+
+        leaf = ~inner
+        nodes = np.empty(len(left), dtype=NODE_DTYPE)
+        nodes['left'] = np.where(inner, left, -1)
+        nodes['right'] = np.where(inner, left + 1, -1)
+        nodes['feature'] = np.where(inner, feature, np.cumsum(leaf) - 1)
+        nodes['threshold'] = np.where(inner, edges[split_bin, np.maximum(feature, 0)], 0.0)
+        nodes['missing_go_to_left'] = 0
+        proba = value[leaf] / weighted_n[leaf][:, np.newaxis]
+
+        setattr(self, 'classes_', classes)
+        setattr(self, 'n_classes_', len(classes))
+        setattr(self, 'n_features_in_', n_features)
+        setattr(self, 'n_outputs_', 1)
+        setattr(self, 'feature_importances_', importances)
+        # The roots are the first nodes, one per tree.
+        setattr(self, 'packed_', PackedForest(nodes, proba, np.arange(self.n_estimators, dtype=np.int64),
+                                              classes, n_features))
+        if self.oob_score:
+            oob_pred = self._oob_predict(X, ~in_bag)
+            setattr(self, 'oob_decision_function_', oob_pred)
+            setattr(self, 'oob_score_', float(np.mean(np.argmax(oob_pred, axis=1) == y_index)))
+
+        return self
+
+    def _oob_predict(self, X, out_of_bag):
+        """ Mean class probabilities of every sample over the trees it is out-of-bag for,
+        zeros (with a warning) for samples in the bag of every tree, as in sklearn.
+        """
+        packed = self.packed_
+        n_samples = X.shape[0]
+        oob_pred = np.zeros((n_samples, self.n_classes_))
+        block = max(1, _MAX_ENTRIES // self.n_estimators)
+        for start in range(0, n_samples, block):
+            stop = min(start + block, n_samples)
+            leaf_proba = packed.value[packed.apply(X[start:stop])]
+            oob_pred[start:stop] = np.einsum('ts,tsc->sc', out_of_bag[:, start:stop], leaf_proba)
+        n_oob = out_of_bag.sum(axis=0)
+        if (n_oob == 0).any():
+            warnings.warn('Some inputs do not have OOB scores. This probably means too few trees '
+                          'were used to compute any reliable OOB estimates.', UserWarning)
+            n_oob[n_oob == 0] = 1
+
+        return oob_pred / n_oob[:, np.newaxis]
+
+    def predict_proba(self, X):
+        """ Predict the class probabilities of X (mean of the tree probabilities). """
+        return self.packed_.predict_proba(X)
+
+    def predict(self, X):
+        """ Predict the class of X. """
+        return self.classes_[np.argmax(self.predict_proba(X), axis=1)]
+
+
+def _n_sub_features(max_features, n_features):
+    """ Number of features drawn for each split (max_features as in sklearn). """
+    if max_features is None:
+        n_sub = n_features
+    elif max_features == 'sqrt':
+        n_sub = int(np.sqrt(n_features))
+    elif max_features == 'log2':
+        n_sub = int(np.log2(n_features))
+    elif isinstance(max_features, (int, np.integer)):
+        n_sub = int(max_features)
+    else:
+        n_sub = int(max_features * n_features)
+
+    return min(max(1, n_sub), n_features)
+
+
+def _ranges(starts, lengths):
+    """ Concatenation of range(start, start + length) for each start and length. """
+    offsets = np.repeat(starts - (np.cumsum(lengths) - lengths), lengths)
+    return offsets + np.arange(offsets.size)
+
+
+def _draw_features(rng, n_nodes, n_features, n_sub):
+    """ Array of shape [n_nodes, n_sub] of distinct features drawn at random for each node. """
+    if n_sub >= n_features:
+        return np.tile(np.arange(n_features), (n_nodes, 1))
+    if 2 * n_sub > n_features:
+        return np.argpartition(rng.random((n_nodes, n_features)), n_sub - 1, axis=1)[:, :n_sub]
+
+    # Few features out of many: the duplicates of a row are drawn again until there are none.
+    draw = rng.integers(0, n_features, (n_nodes, n_sub))
+    while True:
+        draw.sort(axis=1)
+        duplicate = np.zeros(draw.shape, dtype=bool)
+        duplicate[:, 1:] = draw[:, 1:] == draw[:, :-1]
+        n_duplicates = np.count_nonzero(duplicate)
+        if not n_duplicates:
+            return draw
+        draw[duplicate] = rng.integers(0, n_features, n_duplicates)
+
+
+def _grow_forest(codes, y, n_classes, bag_weight, n_sub, max_depth, min_samples_leaf, rng):
+    """ Grow all the trees together, one level per step. The nodes of a level are numbered
+    after the nodes of the previous levels, the children of a node are consecutive and the
+    first nodes are the roots of the trees.
+
+    :param codes: np.array
+        uint8 array of shape [n_samples, n_features] containing the bins of the features.
+
+    :param y: np.array
+        Class index of every sample.
+
+    :param bag_weight: np.array
+        Array of shape [n_trees, n_samples] containing the weight of the samples in each
+        tree (0 for the samples out of its bag).
+
+    :return: tuple
+        Arrays over the nodes: the tree, the weighted class counts [n_nodes, n_classes],
+        the split feature and bin, and the left child (-1 for a leaf).
+    """
+    n_features = codes.shape[1]
+    # Width of the histograms: the bins above the largest one used are always empty.
+    n_bins = int(codes.max(initial=0)) + 1
+    codes = codes.ravel()
+    tree, sample = np.nonzero(bag_weight)
+    weight = bag_weight[tree, sample]
+    label = y[sample]
+    # The samples are grouped by node, node_size is the number of samples of each node of
+    # the level.
+    node_size = np.count_nonzero(bag_weight, axis=1)
+    node_tree = np.arange(len(bag_weight))
+    del tree
+    levels = []
+    n_nodes, depth = len(bag_weight), 0
+    while len(node_size):
+        n_level = len(node_size)
+        node = np.repeat(np.arange(n_level), node_size)
+        value = np.bincount(node * n_classes + label, weights=weight,
+                            minlength=n_level * n_classes).reshape(n_level, n_classes)
+        feature = np.full(n_level, -1, dtype=np.intp)
+        split_bin = np.zeros(n_level, dtype=np.intp)
+        left = np.full(n_level, -1, dtype=np.intp)
+        levels.append((node_tree, value, feature, split_bin, left))
+
+        impure = np.count_nonzero(value, axis=1) > 1
+        to_split = np.flatnonzero(impure & (node_size >= max(2, 2 * min_samples_leaf)))
+        if max_depth is not None and depth >= max_depth:
+            to_split = to_split[:0]
+        starts = np.cumsum(node_size) - node_size
+        split_feature, split_at = _find_splits(codes, n_features, n_bins, sample, label, weight, starts[to_split],
+                                               node_size[to_split], n_classes, n_sub, min_samples_leaf, rng)
+        found = split_feature >= 0
+        to_split, split_feature, split_at = to_split[found], split_feature[found], split_at[found]
+        if not len(to_split):
+            break
+        feature[to_split] = split_feature
+        split_bin[to_split] = split_at
+        left[to_split] = n_nodes + 2 * np.arange(len(to_split))
+        n_nodes += 2 * len(to_split)
+
+        # Samples of the split nodes, grouped by child.
+        inst = _ranges(starts[to_split], node_size[to_split])
+        rank = np.repeat(np.arange(len(to_split)), node_size[to_split])
+        go_right = codes[sample[inst] * n_features + split_feature[rank]] > split_at[rank]
+        child = 2 * rank + go_right
+        node_size = np.bincount(child, minlength=2 * len(to_split))
+        inst = inst[np.argsort(child, kind='stable')]
+        sample, weight, label = sample[inst], weight[inst], label[inst]
+        node_tree = np.repeat(node_tree[to_split], 2)
+        depth += 1
+
+    return tuple(np.concatenate(arrays) for arrays in zip(*levels))
+
+
+def _find_splits(codes, n_features, n_bins, sample, label, weight, starts, sizes, n_classes, n_sub, min_samples_leaf, rng):
+    """ Best split (feature and bin) of each node among n_sub features drawn at random.
+    The nodes whose drawn features are all constant draw new features, until the number
+    of features drawn reaches n_features.
+
+    :return: np.array and np.array
+        Split feature (-1 if no split was found) and bin of each node.
+    """
+    split_feature = np.full(len(starts), -1, dtype=np.intp)
+    split_bin = np.zeros(len(starts), dtype=np.intp)
+    pending = np.arange(len(starts))
+    n_drawn = 0
+    while len(pending) and n_drawn < n_features:
+        draw = _draw_features(rng, len(pending), n_features, n_sub)
+        large = sizes[pending] >= _HIST_MIN_RATIO * n_bins
+        for use_hist in (True, False):
+            nodes = np.flatnonzero(large == use_hist)
+            # Blocks of nodes with at most _MAX_ENTRIES entries (or a single node).
+            block = np.cumsum(sizes[pending[nodes]]) * n_sub // _MAX_ENTRIES
+            bounds = np.flatnonzero(np.diff(block)) + 1
+            for chunk in np.split(nodes, bounds):
+                if not len(chunk):
+                    continue
+                node = pending[chunk]
+                found, best_j, best_bin = _best_splits(codes, n_features, n_bins, sample, label, weight, starts[node],
+                                                       sizes[node], draw[chunk], n_classes, min_samples_leaf,
+                                                       use_hist)
+                split_feature[node[found]] = draw[chunk][found, best_j[found]]
+                split_bin[node[found]] = best_bin[found]
+        n_drawn += n_sub
+        pending = pending[split_feature[pending] < 0]
+
+    return split_feature, split_bin
+
+
+def _best_splits(codes, n_features, n_bins, sample, label, weight, starts, sizes, draw, n_classes, min_samples_leaf, use_hist):
+    """ Best gini split of each node among its drawn features (draw [n_nodes, n_sub]).
+    A split sends the samples with 'bin <= split bin' to the left child, the candidates are
+    the bins holding samples of the node, ties are broken by the lowest (feature rank, bin).
+
+    :param use_hist: bool
+        Whether to accumulate the class weights in [n_nodes * n_sub, n_bins] histograms
+        (large nodes) or sort the (feature, bin) entries of the samples (small nodes).
+
+    :return: np.array, np.array and np.array
+        Whether a split was found, the rank of its feature in draw and its bin for each node.
+    """
+    n_nodes, n_sub = draw.shape
+    inst = _ranges(starts, sizes)
+    rank = np.repeat(np.arange(n_nodes), sizes)
+    # Entry (sample, j) of the feature pair rank * n_sub + j, keyed by pair and bin.
+    pair = (rank * n_sub)[:, np.newaxis] + np.arange(n_sub)
+    index = (np.take(sample, inst) * n_features)[:, np.newaxis] + np.take(draw, rank, axis=0)
+    key = (pair * n_bins + np.take(codes, index)).ravel()
+
+    # Class weights (one row per class) and numbers of samples: left of the candidate
+    # splits and in total, the score of a candidate is -inf if it is not valid.
+    if use_hist:
+        n_cells = n_nodes * n_sub * n_bins
+        hist = np.bincount(np.repeat(label[inst], n_sub) * n_cells + key, weights=np.repeat(weight[inst], n_sub),
+                           minlength=n_classes * n_cells).reshape(n_classes, n_nodes * n_sub, n_bins)
+        count = np.bincount(key, minlength=n_cells).reshape(n_nodes * n_sub, n_bins)
+        left = np.cumsum(hist, axis=2)
+        right = (left[:, :, -1:] - left).reshape(n_classes, n_cells)
+        left = left.reshape(n_classes, n_cells)
+        n_left = np.cumsum(count, axis=1)
+        n_right = (n_left[:, -1:] - n_left).ravel()
+        n_left = n_left.ravel()
+        valid = (count.ravel() > 0) & (n_left >= min_samples_leaf) & (n_right >= min_samples_leaf)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            score = np.where(valid, _proxy_gini(left, right), -np.inf)
+        best = np.argmax(score.reshape(n_nodes, n_sub * n_bins), axis=1)
+        found = np.isfinite(score.reshape(n_nodes, -1)[np.arange(n_nodes), best])
+        return found, best // n_bins, best % n_bins
+
+    # Class weights and number of samples of each distinct (pair, bin) key, in key order.
+    order = np.argsort(key)
+    key = np.take(key, order)
+    entry = np.take(inst, order // n_sub)
+    new_key = np.r_[True, key[1:] != key[:-1]]
+    group = np.cumsum(new_key) - 1
+    key = key[new_key]
+    cum_weight = np.cumsum(np.bincount(np.take(label, entry) * len(key) + group, weights=np.take(weight, entry),
+                                       minlength=n_classes * len(key)).reshape(n_classes, len(key)), axis=1)
+    pair = key // n_bins
+    new_pair = np.r_[True, pair[1:] != pair[:-1]]
+    pair_start = np.flatnonzero(new_pair)
+    pair_stop = np.r_[pair_start[1:], len(key)] - 1
+    pair_index = np.cumsum(new_pair) - 1
+    weight_before = np.hstack((np.zeros((n_classes, 1)), cum_weight))[:, pair_start]
+    # Candidates: a bin followed by another bin of the same pair.
+    last = np.flatnonzero(~new_pair[1:])
+    p = pair_index[last]
+    # (np.take is much faster than fancy indexing along the last axis)
+    before = np.take(weight_before, p, axis=1)
+    left = np.take(cum_weight, last, axis=1) - before
+    right = np.take(cum_weight, pair_stop[p], axis=1) - before - left
+    if min_samples_leaf > 1:
+        cum_count = np.cumsum(np.bincount(group, minlength=len(key)))
+        count_before = np.r_[0, cum_count][pair_start]
+        n_left = cum_count[last] - count_before[p]
+        n_right = cum_count[pair_stop[p]] - count_before[p] - n_left
+        valid = (n_left >= min_samples_leaf) & (n_right >= min_samples_leaf)
+        last, left, right = last[valid], left[:, valid], right[:, valid]
+    score = _proxy_gini(left, right)
+    # The candidates are ordered by node, the first one with the highest score of each
+    # node is its split (the lowest key among equal scores).
+    node = pair[last] // n_sub
+    found = np.zeros(n_nodes, dtype=bool)
+    best_j = np.zeros(n_nodes, dtype=np.intp)
+    best_bin = np.zeros(n_nodes, dtype=np.intp)
+    if len(last):
+        node_start = np.flatnonzero(np.r_[True, node[1:] != node[:-1]])
+        best_score = np.maximum.reduceat(score, node_start)
+        best = np.flatnonzero(score == np.repeat(best_score, np.diff(np.r_[node_start, len(score)])))
+        best = best[np.r_[True, node[best][1:] != node[best][:-1]]]
+        found[node[best]] = True
+        best_j[node[best]] = pair[last[best]] % n_sub
+        best_bin[node[best]] = key[last[best]] % n_bins
+
+    return found, best_j, best_bin
+
+
+def _proxy_gini(left, right):
+    """ Gini improvement of splits up to constants (sklearn's proxy_impurity_improvement):
+    sum of the squared class weights of each child divided by its weight.
+
+    :param left: np.array
+        Array of shape [n_classes, n_splits] containing the class weights of the left children.
+
+    :param right: np.array
+        Array of shape [n_classes, n_splits] containing the class weights of the right children.
+    """
+    return (np.einsum('ij,ij->j', left, left) / np.sum(left, axis=0)
+            + np.einsum('ij,ij->j', right, right) / np.sum(right, axis=0))
@@ -0,0 +1,245 @@
+#!usr/bin/env python
+# loading of the raw sEMG text archive with an on-disk binary cache.
+
+import io
+import os
+import re
+import numpy as np
+
+CACHE_VERSION = 2
+
+# Group directories of the archive and the associated target value.
+GROUPS = {'病例组': 1, '对照组': 0}
+
+SIDES = {'左': 'left', '右': 'right'}
+
+MOVEMENTS = {'自由对掌': 'free', '维持对掌': 'sustained'}
+
+_DATE = re.compile(r'(\d{4})-(\d{1,2})-(\d{1,2})[_-](\d{1,2})-(\d{1,2})-(\d{1,2})')
+_SCORE = re.compile(r'(\d+)分')
+
+# Words of the file names that are not part of the subject name (removed longest first),
+# and the candidate names: a run of 1 to 3 Chinese characters, optionally numbered.
+_NOT_NAME = sorted(['左侧', '右侧', '左手', '右手', '左', '右', '腕管', '肘管', '树兰', '自由对掌', '维持对掌',
+                    '未手术', '正常组', '副本', '慢动作', '感觉为主', '道干扰', '痛风', '姐姐', '分'], key=len, reverse=True)
+_NOT_NAME_RE = re.compile(r'\d+[分芬]|[男女](?:性|\d+岁)|' + '|'.join(_NOT_NAME))
+_NAME_RUN = re.compile(r'[\u4e00-\u9fff]+\d*')
+_NAME = re.compile(r'^[\u4e00-\u9fff]{1,3}\d*$')
+_DAY = re.compile(r'\d{4}-\d{1,2}-\d{1,2}')
+
+
+class sEMGArchive(object):
+
+    def __init__(self, signals, offsets, labels, meta):
+        """ Collection of mean-centred multi-channel sEMG recordings.
+
+        :param signals: np.array
+            Array of shape [n_channels, n_points] containing all the recordings
+            one after another (usually a read-only memory map).
+
+        :param offsets: np.array
+            Array of shape [n_recordings + 1], recording i is signals[:, offsets[i]:offsets[i+1]].
+
+        :param labels: np.array
+            Target value of each recording (1 for case, 0 for control).
+
+        :param meta: dict
+            Arrays of shape [n_recordings] with the metadata read from the file names
+            ('path', 'batch', 'group', 'date', 'side', 'score', 'movement', 'subject').
+        """
+        setattr(self, 'signals', signals)
+        setattr(self, 'offsets', offsets)
+        setattr(self, 'labels', labels)
+        setattr(self, 'meta', meta)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        """ View of shape [n_channels, n_points] on recording i (no copy is made). """
+        return self.signals[:, self.offsets[i]:self.offsets[i+1]]
+
+    def recordings(self):
+        """ List of views on all the recordings. """
+        return [self[i] for i in range(len(self))]
+
+
+def read_recording(path, columns=(5, 7), n_cols=8):
+    """ Read the selected channels of a raw tab separated recording.
+    An unterminated last row (truncated acquisition or trailing text) is dropped.
+
+    :param path: str
+        Path of the text file.
+
+    :param columns: tuple (default=(5, 7))
+        Columns of the file to keep.
+
+    :param n_cols: int (default=8)
+        Number of columns of a complete row.
+
+    :return: np.array
+        Array of shape [len(columns), n_points] containing the raw signals.
+    """
+    with open(path, 'rb') as f:
+        raw = f.read()
+    body, _, tail = raw.rpartition(b'\n')
+    if len(tail.split()) == n_cols:
+        body = raw
+
+    data = np.loadtxt(io.StringIO(body.decode('ascii')), delimiter='\t', usecols=columns, ndmin=2)
+    return np.ascontiguousarray(data.T)
+
+
+def parse_name(name):
+    """ Metadata encoded in the name of a recording file.
+
+    :param name: str
+        File name, e.g. '2019-8-14_11-40-0左侧腕管施爱娟8分.txt'.
+
+    :return: dict
+        'date' (ISO string or ''), 'side' ('left', 'right' or ''), 'score' (int, -1 if absent),
+        'movement' ('free', 'sustained' or '') and 'subject' (see parse_subject).
+    """
+    date = _DATE.search(name)
+    if date is not None:
+        y, m, d, hh, mm, ss = (int(v) for v in date.groups())
+        date = '{:04d}-{:02d}-{:02d}T{:02d}:{:02d}:{:02d}'.format(y, m, d, hh, mm, ss)
+    # The first side word refers to the recorded hand, later ones are clinical notes.
+    sides = [(name.find(k), v) for k, v in SIDES.items() if k in name]
+    score = _SCORE.search(name)
+    movement = [v for k, v in MOVEMENTS.items() if k in name]
+
+    return {'date': date or '',
+            'side': min(sides)[1] if sides else '',
+            'score': int(score.group(1)) if score is not None else -1,
+            'movement': movement[0] if movement else '',
+            'subject': parse_subject(name)}
+
+
+def parse_subject(name):
+    """ Identifier of the subject of a recording file, used to keep all the recordings of
+    a patient on the same side of a train/test split.
+    It is the subject name written in the file name, i.e. the first run of Chinese characters
+    left once the date, side, score and protocol words are removed, if that run is short
+    enough to be a name (clinical notes are not). Files without a name get 'day:<date>':
+    the unnamed recordings of a day are taken as one subject, which may merge patients but
+    never splits one.
+
+    :param name: str
+        File name.
+
+    :return: str
+    """
+    stem = os.path.splitext(name)[0]
+    day = _DAY.search(stem)
+    words = _NAME_RUN.findall(_NOT_NAME_RE.sub(' ', _DATE.sub(' ', stem)))
+    if words and _NAME.match(words[0]):
+        return words[0]
+    if day is not None:
+        return 'day:' + '-'.join('{:02d}'.format(int(v)) for v in day.group().split('-'))
+
+    return stem
+
+
+def list_archive(data_dir='data'):
+    """ List the recordings of the archive.
+    The layout is data_dir/<batch>/<group>/<recording>.txt where group is a key of GROUPS.
+
+    :param data_dir: str (default='data')
+        Root directory of the archive.
+
+    :return: list
+        Sorted list of (batch, group, path) tuples.
+    """
+    files = []
+    for batch in sorted(os.listdir(data_dir)):
+        batch_dir = os.path.join(data_dir, batch)
+        if not os.path.isdir(batch_dir):
+            continue
+        for group in sorted(os.listdir(batch_dir)):
+            group_dir = os.path.join(batch_dir, group)
+            if group not in GROUPS or not os.path.isdir(group_dir):
+                continue
+            for name in sorted(os.listdir(group_dir)):
+                if name.endswith('.txt'):
+                    files.append((batch, group, os.path.join(group_dir, name)))
+
+    return files
+
+
+def load_archive(data_dir='data', cache_dir=None, columns=(5, 7), use_cache=True):
+    """ Load all the recordings of the archive, mean-centred channel by channel.
+    The parsed recordings are stored as a single float32 array plus offsets in cache_dir.
+    The cache is rebuilt when a file is added, removed or modified (size or mtime) and is
+    otherwise memory-mapped, so that later loads do not read the text files.
+
+    :param data_dir: str (default='data')
+        Root directory of the archive.
+
+    :param cache_dir: str (default=None)
+        Cache directory. If 'None', data_dir/.cache is used.
+
+    :param columns: tuple (default=(5, 7))
+        Columns of the raw files to keep.
+
+    :param use_cache: bool (default=True)
+        If False, the text files are parsed and nothing is written on disk.
+
+    :return: sEMGArchive
+    """
+    files = list_archive(data_dir)
+    stats = [os.stat(path) for _, _, path in files]
+    key = {'path': np.array([path for _, _, path in files], dtype=str),
+           'mtime': np.array([s.st_mtime_ns for s in stats], dtype=np.int64),
+           'size': np.array([s.st_size for s in stats], dtype=np.int64),
+           'columns': np.array(columns, dtype=np.int64),
+           'version': np.array(CACHE_VERSION)}
+
+    if cache_dir is None:
+        cache_dir = os.path.join(data_dir, '.cache')
+    index_path = os.path.join(cache_dir, 'index.npz')
+    signals_path = os.path.join(cache_dir, 'signals.npy')
+
+    if use_cache and os.path.exists(index_path) and os.path.exists(signals_path):
+        with np.load(index_path) as index:
+            index = dict(index)
+        if all(np.array_equal(index[k], v) for k, v in key.items()):
+            signals = np.load(signals_path, mmap_mode='r')
+            return _archive_from_index(signals, index)
+
+    recordings = []
+    for _, _, path in files:
+        x = read_recording(path, columns=columns)
+        recordings.append(x - np.mean(x, axis=1, keepdims=True))
+    lengths = [x.shape[1] for x in recordings]
+    offsets = np.concatenate(([0], np.cumsum(lengths))).astype(np.int64)
+
+    signals = np.empty((len(columns), offsets[-1]), dtype=np.float32)
+    for i, x in enumerate(recordings):
+        signals[:, offsets[i]:offsets[i+1]] = x
+
+    meta = [parse_name(os.path.basename(path)) for _, _, path in files]
+    index = dict(key)
+    index['offsets'] = offsets
+    index['label'] = np.array([GROUPS[group] for _, group, _ in files], dtype=np.int64)
+    index['batch'] = np.array([batch for batch, _, _ in files], dtype=str)
+    index['group'] = np.array([group for _, group, _ in files], dtype=str)
+    for k in ('date', 'side', 'score', 'movement', 'subject'):
+        index[k] = np.array([m[k] for m in meta])
+
+    if use_cache:
+        os.makedirs(cache_dir, exist_ok=True)
+        # Written next to the final files then renamed, a crash never leaves a partial cache.
+        np.save(signals_path + '.tmp.npy', signals)
+        np.savez(index_path + '.tmp.npz', **index)
+        os.replace(signals_path + '.tmp.npy', signals_path)
+        os.replace(index_path + '.tmp.npz', index_path)
+        signals = np.load(signals_path, mmap_mode='r')
+
+    return _archive_from_index(signals, index)
+
+
+def _archive_from_index(signals, index):
+    """ Build a sEMGArchive from the signals array and the cache index. """
+    meta = {k: index[k] for k in ('path', 'batch', 'group', 'date', 'side', 'score', 'movement', 'subject')}
+    return sEMGArchive(signals, index['offsets'], index['label'], meta)
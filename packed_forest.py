@@ -0,0 +1,238 @@
+#!usr/bin/env python
+# array-backed random forest for inference.
+
+import numpy as np
+
+# Node record of the flattened trees. For a leaf, left = right = -1 and 'feature'
+# holds the row of the leaf in the value array. 'missing_go_to_left' is the side NaN
+# values are sent to (as in sklearn: the side learned from the training NaNs, or the
+# child with the most samples if there were none).
+NODE_DTYPE = np.dtype([('left', '<i4'), ('right', '<i4'), ('feature', '<i4'), ('threshold', '<f8'),
+                       ('missing_go_to_left', 'u1')])
+
+
+class PackedForest(object):
+
+    def __init__(self, nodes, value, roots, classes, n_features):
+        """ Random Forest classifier stored as flat arrays, used for inference only.
+
+        :param nodes: np.array
+            Array of NODE_DTYPE records of all the trees, child indices are global.
+            Records without 'missing_go_to_left' (models saved before it was packed)
+            cannot predict samples containing NaN.
+
+        :param value: np.array
+            Array of shape [n_leaves, n_classes] containing the class probabilities of the leaves.
+
+        :param roots: np.array
+            Array of shape [n_trees] containing the index of the root node of each tree.
+
+        :param classes: np.array
+            Class labels (the 'classes_' of the original forest).
+
+        :param n_features: int
+            Number of features of the input samples.
+        """
+        setattr(self, 'nodes', nodes)
+        setattr(self, 'value', value)
+        setattr(self, 'roots', roots)
+        setattr(self, 'classes_', classes)
+        setattr(self, 'n_features_in_', int(n_features))
+
+    @classmethod
+    def from_forest(cls, forest):
+        """ Flatten a fitted sklearn RandomForestClassifier.
+
+        :param forest: RandomForestClassifier
+            Fitted single output forest.
+
+        :return: PackedForest
+        """
+        if forest.n_outputs_ != 1:
+            raise ValueError('only single output forests can be packed')
+
+        nodes, value, roots = [], [], []
+        n_nodes, n_leaves = 0, 0
+        for estimator in forest.estimators_:
+            tree = estimator.tree_
+            leaf = tree.children_left == -1
+            tree_nodes = np.empty(tree.node_count, dtype=NODE_DTYPE)
+            tree_nodes['left'] = np.where(leaf, -1, tree.children_left + n_nodes)
+            tree_nodes['right'] = np.where(leaf, -1, tree.children_right + n_nodes)
+            tree_nodes['feature'] = np.where(leaf, np.cumsum(leaf) - 1 + n_leaves, tree.feature)
+            tree_nodes['threshold'] = np.where(leaf, 0., tree.threshold)
+            tree_nodes['missing_go_to_left'] = np.where(leaf, 0, tree.missing_go_to_left)
+
+            # Same normalisation as DecisionTreeClassifier.predict_proba.
+            proba = tree.value[leaf, 0, :forest.n_classes_]
+            normalizer = proba.sum(axis=1)[:, np.newaxis]
+            normalizer[normalizer == 0.0] = 1.0
+
+            nodes.append(tree_nodes)
+            value.append(proba / normalizer)
+            roots.append(n_nodes)
+            n_nodes += tree.node_count
+            n_leaves += np.count_nonzero(leaf)
+
+        return cls(np.concatenate(nodes), np.concatenate(value), np.array(roots, dtype=np.int64),
+                   np.asarray(forest.classes_), forest.n_features_in_)
+
+    @property
+    def n_estimators(self):
+        return len(self.roots)
+
+    def _traversal_arrays(self):
+        """ Arrays used by apply (made on first use): the feature and threshold of the nodes,
+        the [left, right] children of each node, where a leaf child is stored as ~(leaf row),
+        the roots, and whether NaN goes right at each node ('None' if not packed).
+        """
+        arrays = self.__dict__.get('_traversal')
+        if arrays is None:
+            nodes = self.nodes
+            is_leaf = nodes['left'] < 0
+            children = np.stack((nodes['left'], nodes['right']), axis=1).astype(np.intp)
+            child_leaf = is_leaf[np.where(is_leaf[:, None], 0, children)] & ~is_leaf[:, None]
+            children[child_leaf] = ~nodes['feature'][children[child_leaf]]
+            roots = np.asarray(self.roots, dtype=np.intp)
+            roots = np.where(is_leaf[roots], ~nodes['feature'][roots], roots)
+            missing_right = None
+            if 'missing_go_to_left' in nodes.dtype.names:
+                missing_right = nodes['missing_go_to_left'] == 0
+            arrays = (children.ravel(), np.ascontiguousarray(nodes['feature'], dtype=np.intp),
+                      np.ascontiguousarray(nodes['threshold']), roots, missing_right)
+            setattr(self, '_traversal', arrays)
+
+        return arrays
+
+    def apply(self, X):
+        """ Leaf reached by every sample in every tree.
+        All the trees and samples are traversed together, one tree level per step
+        (pairs that reached a leaf are dropped from the following steps).
+        NaN values are routed as in sklearn (see NODE_DTYPE).
+
+        :param X: np.array
+            Array of shape [n_samples, n_features].
+
+        :return: np.array
+            Array of shape [n_trees, n_samples] containing rows of the value array.
+        """
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        children, feature, threshold, roots, missing_right = self._traversal_arrays()
+        n_samples, n_features = X.shape
+        has_nan = bool(np.isnan(X).any())
+        if has_nan and missing_right is None:
+            raise ValueError('this packed forest has no NaN routing (saved by an older version), '
+                             'X must not contain NaN')
+
+        node = np.repeat(roots, n_samples)
+        active = np.flatnonzero(node >= 0)
+        active_node = node[active]
+        active_base = (active % n_samples) * n_features
+        X_flat = X.ravel()
+        while len(active):
+            x = X_flat[active_base + feature[active_node]]
+            go_right = x > threshold[active_node]
+            if has_nan:
+                nan = np.isnan(x)
+                go_right[nan] = missing_right[active_node[nan]]
+            active_node = children[2 * active_node + go_right]
+            inner = active_node >= 0
+            if not inner.all():
+                node[active[~inner]] = active_node[~inner]
+                active, active_node, active_base = active[inner], active_node[inner], active_base[inner]
+
+        return (~node).reshape(len(roots), n_samples)
+
+    def predict_proba(self, X):
+        """ Predict the class probabilities of X, as RandomForestClassifier.predict_proba.
+        The tree outputs are summed in tree order (the result does not depend on threads).
+
+        :param X: np.array
+            Array of shape [n_samples, n_features].
+
+        :return: np.array
+            Array of shape [n_samples, n_classes] containing the mean leaf probabilities.
+        """
+        return _sum_proba(self, X, [0, self.n_estimators])[0]
+
+    def predict(self, X):
+        """ Predict the class of X. """
+        return self.classes_[np.argmax(self.predict_proba(X), axis=1)]
+
+
+class PackedEnsemble(object):
+
+    def __init__(self, forests, feature_maps=None, max_block=1 << 20):
+        """ Several packed forests evaluated in a single traversal of all their trees.
+
+        :param forests: list
+            List of PackedForest with the same number of classes.
+
+        :param feature_maps: list (default=None)
+            For each forest, 'None' or an array giving the column of the ensemble input
+            used as its feature i (e.g. a forest fitted on X[:, index] gets 'index').
+
+        :param max_block: int (default=1 << 20)
+            Maximum number of (tree, sample) pairs traversed at once, larger inputs
+            are processed in blocks of samples.
+        """
+        if feature_maps is None:
+            feature_maps = [None] * len(forests)
+        if len(set(rf.value.shape[1] for rf in forests)) > 1:
+            raise ValueError('forests of an ensemble must have the same number of classes')
+
+        nodes, value, roots, bounds = [], [], [], [0]
+        n_nodes, n_leaves, n_features = 0, 0, 0
+        for rf, feature_map in zip(forests, feature_maps):
+            leaf = rf.nodes['left'] < 0
+            rf_nodes = np.array(rf.nodes)
+            rf_nodes['left'] = np.where(leaf, -1, rf.nodes['left'] + n_nodes)
+            rf_nodes['right'] = np.where(leaf, -1, rf.nodes['right'] + n_nodes)
+            rf_feature = rf.nodes['feature'] if feature_map is None else np.asarray(feature_map)[np.where(leaf, 0, rf.nodes['feature'])]
+            rf_nodes['feature'] = np.where(leaf, rf.nodes['feature'] + n_leaves, rf_feature)
+            nodes.append(rf_nodes)
+            value.append(rf.value)
+            roots.append(np.asarray(rf.roots) + n_nodes)
+            bounds.append(bounds[-1] + rf.n_estimators)
+            n_nodes += len(rf.nodes)
+            n_leaves += len(rf.value)
+            n_features = max(n_features, rf.n_features_in_ if feature_map is None else int(np.max(feature_map)) + 1)
+
+        setattr(self, 'forest', PackedForest(np.concatenate(nodes), np.concatenate(value), np.concatenate(roots),
+                                             forests[0].classes_, n_features))
+        setattr(self, 'bounds', bounds)
+        setattr(self, 'max_block', max_block)
+
+    def __len__(self):
+        return len(self.bounds) - 1
+
+    def predict_proba(self, X):
+        """ Class probabilities predicted by each forest.
+
+        :param X: np.array
+            Array of shape [n_samples, n_features].
+
+        :return: list
+            List of arrays of shape [n_samples, n_classes], one per forest.
+        """
+        return _sum_proba(self.forest, X, self.bounds, self.max_block)
+
+
+def _sum_proba(forest, X, bounds, max_block=1 << 20):
+    """ Mean leaf probabilities of the trees bounds[i]:bounds[i+1] of a packed forest, for each i.
+    The leaf values are summed one tree after the other, as in sklearn with a single job.
+    """
+    X = np.asarray(X)
+    n_samples = X.shape[0]
+    proba = [np.empty((n_samples, forest.value.shape[1])) for _ in range(len(bounds) - 1)]
+
+    block = max(1, max_block // forest.n_estimators)
+    for start in range(0, n_samples, block):
+        stop = min(start + block, n_samples)
+        # [n_trees, n_samples, n_classes], reduced over the first axis tree by tree.
+        leaf_proba = forest.value[forest.apply(X[start:stop])]
+        for i in range(len(bounds) - 1):
+            np.sum(leaf_proba[bounds[i]:bounds[i+1]], axis=0, out=proba[i][start:stop])
+            proba[i][start:stop] /= bounds[i+1] - bounds[i]
+
+    return proba
@@ -0,0 +1,101 @@
+#!usr/bin/env python
+# band-pass denoising of sEMG recordings.
+
+import functools
+import numpy as np
+from scipy.signal import butter, sosfilt, sosfiltfilt
+
+
+@functools.lru_cache(maxsize=None)
+def butter_bandpass_sos(lowcut=20, highcut=250, fs=1000, order=8):
+    """ Butterworth band-pass filter in second-order sections form.
+    The design is cached for each (lowcut, highcut, fs, order).
+
+    :param lowcut: float (default=20)
+        Low cutoff frequency in Hz.
+
+    :param highcut: float (default=250)
+        High cutoff frequency in Hz.
+
+    :param fs: float (default=1000)
+        Sampling frequency in Hz.
+
+    :param order: int (default=8)
+        Order of the filter.
+
+    :return: np.array
+        Read-only array of shape [n_sections, 6], shared between the callers
+        (scipy.signal.sosfilt needs a writable copy of it).
+    """
+    nyq = 0.5 * fs
+    sos = butter(order, [lowcut / nyq, highcut / nyq], btype='band', output='sos')
+    sos.setflags(write=False)
+
+    return sos
+
+
+def bandpass_filter(recordings, lowcut=20, highcut=250, fs=1000, order=8, zero_phase=False):
+    """ Band-pass filter recordings along their last axis.
+    With zero_phase=False the output is the causal output of the notebook's
+    butter_bandpass_filter (up to rounding, the filter runs as second-order sections).
+
+    :param recordings: np.array or list
+        Array of shape [.., n_points] (e.g. [n_recordings, n_channels, n_points]) filtered
+        in a single call, or list of such arrays (recordings can have different lengths).
+
+    :param lowcut, highcut, fs, order:
+        See butter_bandpass_sos.
+
+    :param zero_phase: bool (default=False)
+        If True, the filter is run forward and backward (no phase distortion,
+        squared magnitude response).
+
+    :return: np.array or list
+        Filtered recordings, with the same structure as the input.
+    """
+    if not isinstance(recordings, np.ndarray):
+        return [bandpass_filter(x, lowcut, highcut, fs, order, zero_phase) for x in recordings]
+
+    # sosfilt does not take read-only arrays.
+    sos = np.array(butter_bandpass_sos(lowcut, highcut, fs, order))
+    if zero_phase:
+        return sosfiltfilt(sos, recordings, axis=-1)
+
+    return sosfilt(sos, recordings, axis=-1)
+
+
+class StreamingBandpass(object):
+
+    def __init__(self, n_channels=2, lowcut=20, highcut=250, fs=1000, order=8):
+        """ Causal band-pass filter applied chunk by chunk.
+        The filter state is carried from one chunk to the next, so filtering a recording
+        in chunks gives the same output as filtering it at once.
+
+        :param n_channels: int (default=2)
+            Number of channels of the chunks.
+
+        :param lowcut, highcut, fs, order:
+            See butter_bandpass_sos.
+        """
+        sos = np.array(butter_bandpass_sos(lowcut, highcut, fs, order))
+        setattr(self, 'sos', sos)
+        setattr(self, 'n_channels', n_channels)
+        setattr(self, 'zi', np.zeros((sos.shape[0], n_channels, 2)))
+
+    def filter(self, chunk):
+        """ Filter the next chunk of the stream.
+
+        :param chunk: np.array
+            Array of shape [n_channels, n_points].
+
+        :return: np.array
+            Filtered chunk of shape [n_channels, n_points].
+        """
+        y, zi = sosfilt(self.sos, chunk, axis=-1, zi=self.zi)
+        setattr(self, 'zi', zi)
+
+        return y
+
+    def reset(self):
+        """ Reset the filter state (start of a new stream). """
+        self.zi[...] = 0
@@ -0,0 +1,175 @@
+#!usr/bin/env python
+# per-stage timing and memory records of gcForest.
+
+import functools
+import json
+import threading
+import time
+import numpy as np
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+# [RSS at the start, highest peak seen] of the measured stages being run, innermost last.
+# Each stage resets the kernel peak, the enclosing stages keep their peak here.
+_open_stages = []
+_stages_lock = threading.Lock()
+
+
+def peak_rss():
+    """ Peak resident set size of the process in bytes ('None' if unknown). """
+    if resource is None:
+        return None
+
+    # ru_maxrss is in kilobytes on Linux.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def reset_peak_rss():
+    """ Reset the peak resident set size of the process to its current value (Linux only).
+
+    :return: bool
+        True if the peak was reset.
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        return False
+
+    return True
+
+
+def stage_start():
+    """ Start measuring the peak memory of a stage (see stage_peak_memory).
+
+    :return: list or None
+        Measure of the stage, 'None' if the peak cannot be reset (not Linux).
+    """
+    with _stages_lock:
+        # The peak reached so far by the enclosing stage is lost by the reset.
+        if _open_stages:
+            _open_stages[-1][1] = max(_open_stages[-1][1], peak_rss())
+        if not reset_peak_rss():
+            return None
+        start = peak_rss()
+        stage = [start, start]
+        _open_stages.append(stage)
+
+    return stage
+
+
+def stage_peak_memory(stage):
+    """ End the measure of a stage started by stage_start.
+
+    :return: int or None
+        Growth in bytes of the peak resident set size of the process during the stage,
+        stages run inside it included.
+    """
+    if stage is None:
+        return None
+    with _stages_lock:
+        peak = max(stage[1], peak_rss())
+        if stage in _open_stages:
+            _open_stages.remove(stage)
+        if _open_stages:
+            _open_stages[-1][1] = max(_open_stages[-1][1], peak)
+
+    return peak - stage[0]
+
+
+def describe(value):
+    """ JSON serializable summary of a stage input or output: shape, dtype and size in
+    bytes of arrays (and of lists of arrays), the value itself for numbers and strings.
+    """
+    if isinstance(value, np.ndarray):
+        return {'shape': list(value.shape), 'dtype': value.dtype.str, 'nbytes': int(value.nbytes)}
+    if isinstance(value, (list, tuple)) and value and all(isinstance(v, np.ndarray) for v in value):
+        return {'n_arrays': len(value), 'shape': list(value[0].shape),
+                'nbytes': int(sum(v.nbytes for v in value))}
+    if isinstance(value, np.generic):
+        return value.item()
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+
+    return repr(value)
+
+
+def profiled(event, stage_info):
+    """ Decorator of a gcForest method reporting each call to the model callbacks.
+    Without callbacks the method is called directly, nothing is measured.
+
+    :param event: str
+        Name of the stage.
+
+    :param stage_info: function
+        Called with the arguments of the method, returns a dict of values describing
+        the call (layer, window size, input array, ..).
+
+    :return: function
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            callbacks = getattr(self, 'callbacks', None)
+            if not callbacks:
+                return method(self, *args, **kwargs)
+
+            info = stage_info(self, *args, **kwargs)
+            stage = stage_start()
+            wall, cpu = time.perf_counter(), time.process_time()
+            try:
+                result = method(self, *args, **kwargs)
+            finally:
+                wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+                peak_memory = stage_peak_memory(stage)
+            record = {'event': event,
+                      'wall_time': wall,
+                      'cpu_time': cpu,
+                      'peak_memory': peak_memory}
+            record.update((k, describe(v)) for k, v in info.items())
+            record['output'] = describe(result)
+            for callback in callbacks:
+                callback(record)
+
+            return result
+
+        return wrapper
+
+    return decorator
+
+
+class Recorder(object):
+
+    def __init__(self, path=None):
+        """ gcForest callback keeping the stage records, optionally written as JSON lines.
+
+        :param path: str (default=None)
+            File the records are appended to, one JSON object per line.
+            If 'None' the records are only kept in memory.
+        """
+        setattr(self, 'path', path)
+        setattr(self, 'records', [])
+
+    def __call__(self, record):
+        self.records.append(record)
+        if self.path is not None:
+            with open(self.path, 'a') as f:
+                f.write(json.dumps(record) + '\n')
+
+    def totals(self):
+        """ Number of calls, wall time and CPU time summed by event.
+
+        :return: dict
+            event: {'calls', 'wall_time', 'cpu_time'}.
+        """
+        totals = {}
+        for record in self.records:
+            total = totals.setdefault(record['event'], {'calls': 0, 'wall_time': 0., 'cpu_time': 0.})
+            total['calls'] += 1
+            total['wall_time'] += record['wall_time']
+            total['cpu_time'] += record['cpu_time']
+
+        return totals
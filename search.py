@@ -0,0 +1,224 @@
+#!usr/bin/env python
+# hyper-parameter search of gcForest by successive halving of the cascade depth.
+
+import itertools
+import logging
+import math
+import os
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from sklearn.metrics import accuracy_score
+from sklearn.model_selection import train_test_split
+
+from GCForest import gcForest
+
+logger = logging.getLogger(__name__)
+
+# Parameters of the Multi Grain Scanning, candidates sharing them share its output.
+MGS_PARAMS = ('shape_1X', 'n_mgsRF', 'n_mgsRFtree', 'window', 'stride', 'min_samples_mgs',
+              'mgs_batch_size', 'mgs_max_windows', 'forest_backend', 'forest_bins', 'random_state')
+
+
+def parameter_grid(param_grid):
+    """ All the combinations of the values of a grid.
+
+    :param param_grid: dict
+        name: list of values.
+
+    :return: list
+        List of dict name: value.
+    """
+    names = sorted(param_grid)
+    return [dict(zip(names, values)) for values in itertools.product(*(param_grid[name] for name in names))]
+
+
+def successive_halving(X, y, param_grid, base_params=None, X_val=None, y_val=None, validation_size=0.2,
+                       min_layers=2, max_layers=8, eta=2, n_workers=None, random_state=0):
+    """ Successive halving search of gcForest parameters, the resource being the depth
+    of the cascade. All the candidates are trained with a budget of min_layers layers and
+    scored on the validation set, the best 1/eta of them get eta times more layers, and
+    so on until one candidate is left or max_layers is reached.
+    With a budget b, a candidate is the model gcForest.fit gives with max_cascade_layer=b
+    (b at least its min_cascade_layer): like fit, the growth stops after the first layer
+    past b, which is kept only if it improves the accuracy, so up to b + 1 layers.
+    Nothing is trained twice: candidates with the same Multi Grain Scanning parameters
+    (MGS_PARAMS) share one scan of the train and validation sets, and the cascade of a
+    candidate is paused between rungs and resumed (gcForest.grow_cascade) to add layers
+    to the already trained ones. The candidates of a rung are trained in parallel on a
+    thread pool, each forest running single threaded by default.
+    A cascade can stop before its budget (no improvement within tolerance), it then keeps
+    its score in the following rungs without training.
+
+    :param X: np.array
+        Array containing the training samples, of shape [n_samples, data].
+
+    :param y: np.array
+        1D array containing the target values (0, .., n_classes-1).
+
+    :param param_grid: dict or list
+        Grid of parameters (name: list of values, see parameter_grid) or list of
+        parameter dicts, one per candidate.
+
+    :param base_params: dict (default=None)
+        Parameters common to all the candidates. n_jobs defaults to 1.
+
+    :param X_val, y_val: np.array (default=None)
+        Validation set. If 'None' validation_size of X is held out (stratified).
+
+    :param validation_size: float (default=0.2)
+        Fraction of X held out for validation when X_val is 'None'.
+
+    :param min_layers: int (default=2)
+        Cascade layer budget (max_cascade_layer) of the first rung.
+
+    :param max_layers: int (default=8)
+        Largest budget, the max_cascade_layer of a candidate is used if lower.
+
+    :param eta: int (default=2)
+        Reduction factor: 1/eta of the candidates are kept and the budget is multiplied
+        by eta at each rung.
+
+    :param n_workers: int (default=None)
+        Number of threads training candidates. If 'None' the number of cores is used.
+
+    :param random_state: int (default=0)
+        Seed of the validation split.
+
+    :return: dict
+        'best_params', 'best_score', 'best_model' (trained on X without the validation
+        set) and 'history', one record per candidate and rung: 'rung', 'budget', 'params',
+        'score', 'n_layer' and 'finished'.
+    """
+    base_params = dict(base_params or {})
+    base_params.setdefault('n_jobs', 1)
+    if isinstance(param_grid, dict):
+        param_grid = parameter_grid(param_grid)
+    candidates = [dict(base_params, **params) for params in param_grid]
+    if X_val is None:
+        X, X_val, y, y_val = train_test_split(X, y, stratify=y, test_size=validation_size, random_state=random_state)
+
+    with ThreadPoolExecutor(max_workers=n_workers or os.cpu_count()) as pool:
+        keys = {}
+        for params in candidates:
+            keys.setdefault(_mgs_key(params), params)
+        scans = dict(zip(keys, pool.map(lambda params: _scan(params, X, y, X_val), keys.values())))
+
+        alive = [_Candidate(params, scans[_mgs_key(params)], y, max_layers) for params in candidates]
+        history = []
+        rung, budget = 0, min_layers
+        while True:
+            list(pool.map(lambda candidate: candidate.advance(budget, y_val), alive))
+            for candidate in alive:
+                history.append({'rung': rung, 'budget': budget, 'params': candidate.params, 'score': candidate.score,
+                                'n_layer': candidate.n_layer, 'finished': candidate.finished})
+            logger.info('Rung {}: {} candidates with at most {} layers, best score {}'.format(
+                rung, len(alive), budget, max(candidate.score for candidate in alive)))
+            if len(alive) == 1 or budget >= max_layers:
+                break
+
+            # Stable sort, ties are kept in the order of the grid.
+            alive = sorted(alive, key=lambda candidate: -candidate.score)[:max(1, int(math.ceil(len(alive) / float(eta))))]
+            rung, budget = rung + 1, min(max_layers, budget * eta)
+
+    best = max(alive, key=lambda candidate: candidate.score)
+    best.close()
+
+    return {'best_params': best.params, 'best_score': best.score, 'best_model': best.model, 'history': history}
+
+
+class _Candidate(object):
+
+    def __init__(self, params, scan, y, max_layers):
+        """ gcForest of the search, whose cascade is grown rung after rung.
+
+        :param params: dict
+            Parameters of the model.
+
+        :param scan: tuple
+            Scanning model and Multi Grain Scanning outputs of the train and validation sets.
+
+        :param y: np.array
+            Target values of the train set.
+
+        :param max_layers: int
+            Largest budget of the search.
+        """
+        scanner, train_X, val_X = scan
+        model = gcForest(**params)
+        # The MGS forests are shared with the other candidates of the same scan.
+        for name, value in vars(scanner).items():
+            if name.startswith(('_mgsprf_', '_mgscrf_', '_packed_mgs_')):
+                setattr(model, name, value)
+        setattr(model, 'max_cascade_layer', min(getattr(model, 'max_cascade_layer'), max_layers))
+
+        setattr(self, 'params', params)
+        setattr(self, 'model', model)
+        setattr(self, 'val_X', val_X)
+        setattr(self, 'score', None)
+        setattr(self, 'n_layer', 0)
+        setattr(self, 'finished', False)
+        setattr(self, '_growth', model.grow_cascade(train_X, y))
+        setattr(self, '_last', None)
+
+    def advance(self, budget, y_val):
+        """ Add layers until the cascade stops or exceeds 'budget' layers (same rule as
+        max_cascade_layer in gcForest.cascade_forest), then score the model fit would
+        return with that max_cascade_layer.
+        """
+        model = self.model
+        budget = max(budget, getattr(model, 'min_cascade_layer'))
+        while not self.finished:
+            if self._last is None:
+                self._last = next(self._growth)
+            accuracy_ref, accuracy_layer, _ = self._last
+            improving = accuracy_layer > accuracy_ref + getattr(model, 'tolerance') or \
+                model.n_layer <= getattr(model, 'min_cascade_layer')
+            if not improving or model.n_layer > getattr(model, 'max_cascade_layer'):
+                self.close()
+            elif model.n_layer > budget:
+                break
+            else:
+                self._last = next(self._growth)
+
+        # fit would drop the last layer if it did not improve the accuracy, it is kept
+        # (but not scored) while the growth is only paused.
+        n_layer = model.n_layer
+        if not self.finished and self._last[1] <= self._last[0]:
+            n_layer -= 1
+        if self.score is None or n_layer != self.n_layer:
+            state = {}
+            for at_layer in range(1, n_layer + 1):
+                pred = model._cascade_forward(self.val_X, at_layer, state)
+            self.score = accuracy_score(y_val, np.argmax(np.mean(pred, axis=0), axis=1))
+            self.n_layer = n_layer
+
+    def close(self):
+        """ Stop the growth of the cascade (releases its training arrays), removing the
+        last layer if it did not improve the accuracy, as fit does.
+        """
+        if self.finished:
+            return
+        self._growth.close()
+        self.finished = True
+        if self._last is not None and self._last[1] <= self._last[0]:
+            self.model._drop_last_layer()
+
+
+def _mgs_key(params):
+    """ Hashable key of the Multi Grain Scanning parameters of a candidate. """
+    model = gcForest(**params)
+    return tuple(repr(getattr(model, name)) for name in MGS_PARAMS)
+
+
+def _scan(params, X, y, X_val):
+    """ Multi Grain Scanning of the train and validation sets with the MGS parameters
+    of a candidate.
+
+    :return: tuple
+        Model holding the MGS forests, train output and validation output.
+    """
+    scanner = gcForest(**params)
+    train_X = scanner.mg_scanning(X, y)
+    val_X = scanner.mg_scanning(X_val)
+
+    return scanner, train_X, val_X
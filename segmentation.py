@@ -0,0 +1,184 @@
+#!usr/bin/env python
+# splitting of the recordings into one sample per repetition of the movement.
+
+import numpy as np
+
+from preprocessing import bandpass_filter
+
+
+def rms_envelope(x, window, offsets=None):
+    """ Centred moving RMS of the signals along the last axis.
+
+    :param x: np.array
+        Array of shape [.., n_points] containing the signals.
+
+    :param window: int
+        Length of the moving window in points.
+
+    :param offsets: np.array (default=None)
+        Boundaries [0, .., n_points] of recordings concatenated along the last axis,
+        the windows do not cross them (they are shorter near the ends of a recording).
+        If 'None' x holds a single recording.
+
+    :return: np.array
+        Array of the same shape as x containing the envelope.
+    """
+    n_points = x.shape[-1]
+    offsets = np.asarray([0, n_points] if offsets is None else offsets)
+    rec = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+    pos = np.arange(n_points)
+    lo = np.maximum(pos - window // 2, offsets[:-1][rec])
+    hi = np.minimum(pos + window - window // 2, offsets[1:][rec])
+
+    energy = np.zeros(x.shape[:-1] + (n_points + 1,))
+    np.cumsum(np.square(x, dtype=np.float64), axis=-1, out=energy[..., 1:])
+    return np.sqrt(np.maximum(energy[..., hi] - energy[..., lo], 0.) / (hi - lo))
+
+
+def detect_activations(recordings, fs=1000, window_ms=100, threshold=0.3, min_duration_ms=300,
+                       min_gap_ms=200, bandpass=True):
+    """ Onsets and offsets of the muscle activations (repetitions of the movement).
+    All the recordings are processed together: the channels are band-pass filtered,
+    their RMS envelope is scaled per recording and channel between its 10th and 99th
+    percentiles, and a point is active when the scaled envelope of any channel is above
+    the threshold. Activations separated by less than min_gap_ms are merged, the ones
+    shorter than min_duration_ms are dropped.
+
+    :param recordings: np.array or list
+        Array of shape [n_recordings, n_channels, n_points] or list of
+        [n_channels, n_points] arrays (recordings can have different lengths).
+
+    :param fs: float (default=1000)
+        Sampling frequency of the recordings.
+
+    :param window_ms: float (default=100)
+        Length of the RMS window.
+
+    :param threshold: float (default=0.3)
+        Activation level, as a fraction of the envelope range of the recording.
+
+    :param min_duration_ms: float (default=300)
+        Minimum length of an activation.
+
+    :param min_gap_ms: float (default=200)
+        Minimum rest between two activations.
+
+    :param bandpass: bool (default=True)
+        If True, the envelope is computed on the 20-250Hz band (zero phase filter).
+
+    :return: np.array, np.array and np.array
+        Recording index, onset and offset (excluded) in points of every activation,
+        sorted by recording and onset.
+    """
+    if bandpass:
+        recordings = bandpass_filter([np.asarray(x, dtype=np.float64) for x in recordings], fs=fs, zero_phase=True)
+    signals, offsets = _concatenate(recordings)
+    rec = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+
+    envelope = rms_envelope(signals, max(1, int(round(fs * window_ms / 1000.))), offsets)
+    low, high = _segment_percentiles(envelope, offsets, (10, 99))
+    scale = np.where(high > low, high - low, 1.)
+    active = np.max((envelope - low[:, rec]) / scale[:, rec], axis=0) > threshold
+
+    # An activation cannot run over the end of a recording.
+    first = np.zeros(len(active), dtype=bool)
+    first[offsets[:-1][offsets[:-1] < len(active)]] = True
+    last = np.zeros(len(active), dtype=bool)
+    last[offsets[1:][offsets[1:] > 0] - 1] = True
+    onsets = np.flatnonzero(active & (first | ~np.roll(active, 1)))
+    ends = np.flatnonzero(active & (last | ~np.roll(active, -1))) + 1
+    act_rec = rec[onsets]
+
+    merged = np.zeros(len(onsets), dtype=bool)
+    merged[1:] = (act_rec[1:] == act_rec[:-1]) & (onsets[1:] - ends[:-1] < fs * min_gap_ms / 1000.)
+    onsets, ends, act_rec = onsets[~merged], ends[np.append(~merged[1:], True)], act_rec[~merged]
+
+    keep = ends - onsets >= fs * min_duration_ms / 1000.
+    act_rec = act_rec[keep]
+    return act_rec, onsets[keep] - offsets[act_rec], ends[keep] - offsets[act_rec]
+
+
+def segment_recordings(recordings, labels=None, groups=None, fs=1000, length_ms=1000, **detect_params):
+    """ Cut the recordings into fixed-length windows, one per activation (see
+    detect_activations), centred on the activation and moved inside the recording when
+    needed. The windows are taken from the recordings as given, the band-pass filter of
+    the detection is not applied to them. They can be passed directly to the feature
+    extractors (features.psd_lbp_features, ..).
+
+    :param recordings: np.array or list
+        Array of shape [n_recordings, n_channels, n_points] or list of
+        [n_channels, n_points] arrays (recordings can have different lengths).
+
+    :param labels: np.array (default=None)
+        Target value of each recording.
+
+    :param groups: np.array (default=None)
+        Group (subject) of each recording, to be used for grouped cross-validation.
+
+    :param fs: float (default=1000)
+        Sampling frequency of the recordings.
+
+    :param length_ms: float (default=1000)
+        Length of the windows. Recordings shorter than that give no window.
+
+    :param detect_params:
+        Parameters of detect_activations.
+
+    :return: np.array, np.array, np.array and np.array
+        Windows of shape [n_windows, n_channels, length], labels and groups of the windows
+        ('None' when not given) and index of the recording of every window.
+    """
+    signals, offsets = _concatenate(recordings)
+    rec, onsets, ends = detect_activations(recordings, fs=fs, **detect_params)
+
+    length = int(round(fs * length_ms / 1000.))
+    n_points = np.diff(offsets)[rec]
+    keep = n_points >= length
+    rec, onsets, ends, n_points = rec[keep], onsets[keep], ends[keep], n_points[keep]
+    start = np.clip((onsets + ends) // 2 - length // 2, 0, n_points - length)
+
+    index = (offsets[rec] + start)[:, None] + np.arange(length)
+    windows = np.moveaxis(signals[:, index], 0, 1)
+
+    return (windows,
+            None if labels is None else np.asarray(labels)[rec],
+            None if groups is None else np.asarray(groups)[rec],
+            rec)
+
+
+def segment_archive(archive, fs=1000, length_ms=1000, **detect_params):
+    """ segment_recordings on all the recordings of a loader.sEMGArchive, with the labels
+    of the recordings and their subjects as groups.
+
+    :return: np.array, np.array, np.array and np.array
+        See segment_recordings.
+    """
+    return segment_recordings(archive.recordings(), archive.labels, archive.meta['subject'],
+                              fs=fs, length_ms=length_ms, **detect_params)
+
+
+def _concatenate(recordings):
+    """ Recordings concatenated along the last axis, and their boundaries.
+
+    :return: np.array and np.array
+        Array of shape [n_channels, n_points] and array [0, .., n_points].
+    """
+    lengths = [np.shape(x)[-1] for x in recordings]
+    offsets = np.concatenate(([0], np.cumsum(lengths))).astype(np.int64)
+
+    return np.concatenate(list(recordings), axis=-1), offsets
+
+
+def _segment_percentiles(x, offsets, q):
+    """ Percentiles ('lower' interpolation) of every segment offsets[i]:offsets[i+1] of
+    the signals along the last axis, computed with a single sort.
+
+    :return: list
+        For every percentile, an array of shape [.., n_segments].
+    """
+    rec = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+    order = np.lexsort((x, np.broadcast_to(rec, x.shape)), axis=-1)
+    sorted_x = np.take_along_axis(x, order, axis=-1)
+    lengths = np.diff(offsets)
+
+    return [sorted_x[..., offsets[:-1] + (p / 100. * np.maximum(lengths - 1, 0)).astype(np.int64)] for p in q]
@@ -0,0 +1,159 @@
+#!usr/bin/env python
+# compact on-disk format for trained gcForest models.
+
+import inspect
+import json
+import os
+import re
+import threading
+import numpy as np
+from sklearn.ensemble import RandomForestClassifier
+
+from GCForest import gcForest
+from hist_forest import HistRandomForestClassifier
+from packed_forest import PackedForest
+
+FORMAT_NAME = 'gcforest-packed'
+FORMAT_VERSION = 2
+# Versions load_gcforest reads, the forests of version 1 do not store the NaN routing.
+_READ_VERSIONS = (1, 2)
+
+# Attribute name patterns of the forests and the directory they are stored in.
+_GROUPS = [(re.compile(r'^_mgs[pc]rf_'), lambda m: 'mgs'),
+           (re.compile(r'^_cas[pc]rf(\d+)_\d+$'), lambda m: 'layer_' + m.group(1)),
+           (re.compile(r'^_casclf_[12](\d+)$'), lambda m: 'layer_' + m.group(1)),
+           (re.compile(r'^_casclf(\d+)_\d+$'), lambda m: 'layer_' + m.group(1))]
+
+# Fitted arrays kept in the saved model, the other arrays only live during fit.
+_ARRAYS = ('_inedx_', '_index_')
+
+# Serializes the loading of lazy groups when several threads predict with the same model.
+_LOAD_LOCK = threading.Lock()
+
+
+class _LazyGCForest(gcForest):
+    """ gcForest loaded from disk, the forests of a layer are read on first access. """
+
+    def __getattr__(self, name):
+        lazy = self.__dict__.get('_lazy_estimators')
+        if lazy is None or (name not in lazy and name not in self.__dict__):
+            raise AttributeError(name)
+        with _LOAD_LOCK:
+            # Another thread may have loaded the group in the meantime.
+            if name in lazy:
+                self._load_group(lazy[name])
+
+        return self.__dict__[name]
+
+    def _load_group(self, group):
+        """ Memory-map all the forests of a group (MGS or one cascade layer). """
+        lazy = self.__dict__['_lazy_estimators']
+        folder = os.path.join(self.__dict__['_lazy_path'], group)
+        for name in [n for n, g in lazy.items() if g == group]:
+            info = self.__dict__['_lazy_info'][name]
+            forest = PackedForest(np.load(os.path.join(folder, name + '.nodes.npy'), mmap_mode='r'),
+                                  np.load(os.path.join(folder, name + '.value.npy'), mmap_mode='r'),
+                                  np.load(os.path.join(folder, name + '.roots.npy')),
+                                  np.asarray(info['classes']), info['n_features'])
+            setattr(self, name, forest)
+            del lazy[name]
+
+
+def save_gcforest(model, path):
+    """ Save a trained gcForest in a directory.
+    Every forest is stored as flat node, leaf value and root arrays (see PackedForest),
+    without the out-of-bag buffers, together with the feature index arrays of the layers
+    and a 'model.json' manifest holding the parameters.
+
+    :param model: gcForest
+        Trained model.
+
+    :param path: str
+        Output directory (created if needed).
+    """
+    params = {}
+    for name in inspect.signature(gcForest.__init__).parameters:
+        if name not in ('self', 'callbacks') and hasattr(model, name):
+            params[name] = _to_json(getattr(model, name))
+    state = {name: _to_json(getattr(model, name))
+             for name in ('n_layer', 'num_classes') if hasattr(model, name)}
+
+    estimators, arrays = {}, []
+    for name, value in sorted(vars(model).items()):
+        if isinstance(value, (RandomForestClassifier, HistRandomForestClassifier, PackedForest)):
+            if isinstance(value, HistRandomForestClassifier):
+                packed = value.packed_
+            else:
+                packed = value if isinstance(value, PackedForest) else PackedForest.from_forest(value)
+            group = _group(name)
+            folder = os.path.join(path, group)
+            os.makedirs(folder, exist_ok=True)
+            np.save(os.path.join(folder, name + '.nodes.npy'), packed.nodes)
+            np.save(os.path.join(folder, name + '.value.npy'), packed.value)
+            np.save(os.path.join(folder, name + '.roots.npy'), packed.roots)
+            estimators[name] = {'group': group, 'classes': _to_json(packed.classes_),
+                                'n_features': packed.n_features_in_}
+        elif name.startswith(_ARRAYS):
+            os.makedirs(os.path.join(path, 'arrays'), exist_ok=True)
+            np.save(os.path.join(path, 'arrays', name + '.npy'), value)
+            arrays.append(name)
+
+    manifest = {'format': FORMAT_NAME, 'version': FORMAT_VERSION, 'params': params,
+                'state': state, 'estimators': estimators, 'arrays': arrays}
+    with open(os.path.join(path, 'model.json'), 'w') as f:
+        json.dump(manifest, f, indent=1)
+
+
+def load_gcforest(path, lazy=True):
+    """ Load a gcForest saved by save_gcforest.
+    Arrays are memory-mapped. With lazy=True only the manifest is read, the forests
+    of a layer are mapped the first time one of them is used.
+
+    :param path: str
+        Directory written by save_gcforest.
+
+    :param lazy: bool (default=True)
+        If False, all the forests are mapped immediately.
+
+    :return: gcForest
+        Model for prediction (its forests are PackedForest instances).
+    """
+    with open(os.path.join(path, 'model.json')) as f:
+        manifest = json.load(f)
+    if manifest.get('format') != FORMAT_NAME or manifest.get('version') not in _READ_VERSIONS:
+        raise ValueError('{} is not a gcForest model saved with format version {}'.format(path, FORMAT_VERSION))
+
+    model = _LazyGCForest(**manifest['params'])
+    for name, value in manifest['state'].items():
+        setattr(model, name, value)
+    for name in manifest['arrays']:
+        setattr(model, name, np.load(os.path.join(path, 'arrays', name + '.npy'), mmap_mode='r'))
+
+    setattr(model, '_lazy_path', path)
+    setattr(model, '_lazy_info', manifest['estimators'])
+    setattr(model, '_lazy_estimators', {name: info['group'] for name, info in manifest['estimators'].items()})
+    if not lazy:
+        for group in sorted(set(model._lazy_estimators.values())):
+            model._load_group(group)
+
+    return model
+
+
+def _group(name):
+    """ Directory of the forest stored in attribute 'name'. """
+    for pattern, group in _GROUPS:
+        match = pattern.match(name)
+        if match:
+            return group(match)
+
+    return 'other'
+
+
+def _to_json(value):
+    """ Convert numpy values to their JSON serializable python equivalent. """
+    if isinstance(value, (np.ndarray, np.generic)):
+        return value.tolist()
+    if isinstance(value, tuple):
+        return list(value)
+
+    return value
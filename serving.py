@@ -0,0 +1,140 @@
+#!usr/bin/env python
+# batched serving of a trained gcForest to concurrent callers.
+
+import asyncio
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+import numpy as np
+
+
+class BatchingPredictor(object):
+
+    def __init__(self, model, max_batch_size=64, max_wait_ms=5., n_workers=1):
+        """ Thread-safe front of a trained model for many concurrent callers.
+        Requests (typically one patient, i.e. one feature row, each) are queued and a
+        dispatcher thread coalesces the ones arriving within 'max_wait_ms' of each
+        other into a single predict_proba call on the stacked rows, so that the
+        forests are traversed once per batch instead of once per request.
+        All the batches use the same model (its prediction does not modify it).
+
+        :param model: object
+            Trained classifier with a predict_proba method (e.g. gcForest, or a model
+            returned by serialization.load_gcforest).
+
+        :param max_batch_size: int (default=64)
+            Maximum number of rows of a batch, a batch is sent as soon as it is full.
+
+        :param max_wait_ms: float (default=5.)
+            Longest time the first request of a batch waits for other requests.
+
+        :param n_workers: int (default=1)
+            Number of batches predicted at the same time (threads of the pool).
+        """
+        if hasattr(model, 'compile'):
+            model.compile()
+
+        setattr(self, 'model', model)
+        setattr(self, 'max_batch_size', int(max_batch_size))
+        setattr(self, 'max_wait_ms', max_wait_ms)
+        setattr(self, 'n_batches', 0)
+        setattr(self, 'n_requests', 0)
+        setattr(self, '_queue', queue.Queue())
+        setattr(self, '_lock', threading.Lock())
+        setattr(self, '_closed', False)
+        setattr(self, '_executor', ThreadPoolExecutor(max_workers=n_workers))
+        setattr(self, '_dispatcher', threading.Thread(target=self._dispatch, daemon=True))
+        self._dispatcher.start()
+
+    def submit(self, X):
+        """ Queue a prediction request.
+
+        :param X: np.array
+            Array of shape [n_features] (single sample) or [n_samples, n_features].
+
+        :return: concurrent.futures.Future
+            Future of the class probabilities, of shape [n_classes] for a single
+            sample and [n_samples, n_classes] otherwise.
+        """
+        X = np.asarray(X)
+        future = Future()
+        with self._lock:
+            if self._closed:
+                raise RuntimeError('cannot submit to a closed BatchingPredictor')
+            self._queue.put((np.atleast_2d(X), X.ndim == 1, future))
+
+        return future
+
+    def predict_proba(self, X):
+        """ Class probabilities of X, waiting for the batch it is part of (see submit). """
+        return self.submit(X).result()
+
+    def predict(self, X):
+        """ Predicted class of X (index of the most probable class, as gcForest.predict). """
+        return np.argmax(self.predict_proba(X), axis=-1)
+
+    async def predict_proba_async(self, X):
+        """ Coroutine version of predict_proba, for asyncio servers. """
+        return await asyncio.wrap_future(self.submit(X))
+
+    def close(self):
+        """ Predict the requests already queued, then stop the threads. """
+        with self._lock:
+            if self._closed:
+                return
+            setattr(self, '_closed', True)
+            self._queue.put(None)
+        self._dispatcher.join()
+        self._executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _dispatch(self):
+        """ Dispatcher thread: group the queued requests into batches. """
+        max_wait = getattr(self, 'max_wait_ms') / 1000.
+        max_batch_size = getattr(self, 'max_batch_size')
+
+        stop = False
+        while not stop:
+            request = self._queue.get()
+            if request is None:
+                break
+            batch, n_rows = [request], len(request[0])
+            deadline = time.monotonic() + max_wait
+            while n_rows < max_batch_size:
+                try:
+                    request = self._queue.get(timeout=max(0., deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if request is None:
+                    stop = True
+                    break
+                batch.append(request)
+                n_rows += len(request[0])
+
+            self.n_batches += 1
+            self.n_requests += len(batch)
+            self._executor.submit(self._predict_batch, batch)
+
+    def _predict_batch(self, batch):
+        """ Predict a batch of requests and set the result of their futures. """
+        batch = [request for request in batch if request[2].set_running_or_notify_cancel()]
+        if not batch:
+            return
+
+        try:
+            proba = self.model.predict_proba(np.concatenate([X for X, _, _ in batch], axis=0))
+        except BaseException as e:
+            for _, _, future in batch:
+                future.set_exception(e)
+            return
+
+        start = 0
+        for X, single, future in batch:
+            future.set_result(proba[start] if single else proba[start:start + len(X)])
+            start += len(X)
@@ -0,0 +1,208 @@
+#!usr/bin/env python
+# online scoring of live multi-channel sEMG with a trained gcForest.
+
+import collections
+import time
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from features import lbp_codes, psd_values
+from preprocessing import StreamingBandpass
+
+
+class StreamingPredictor(object):
+
+    def __init__(self, model, n_channels=2, fs=1000, window=4992, update_ms=250, neighborhood=4,
+                 nperseg=256, latency_budget_ms=None, lowcut=20, highcut=250, order=8):
+        """ Online PSD+LBP scoring of a sEMG stream.
+        Raw chunks are band-pass filtered with a persistent filter state, the LBP histogram
+        and the Welch segment periodograms of the last 'window' points are updated
+        incrementally, and every 'update_ms' the model is evaluated on the
+        [PSD of each channel, LBP histogram of each channel] feature row (the layout of
+        features.psd_lbp_features) of the 'window' points ending at the update.
+        Both features follow the Welch segment grid (steps of nperseg // 2 points from the
+        start of the stream), so they always cover the same points: the update times are
+        multiples of update_points, itself a multiple of nperseg // 2, and the points
+        received after the last grid point wait in the tail until the next one.
+        Memory does not depend on the length of the stream.
+
+        :param model: object
+            Trained classifier with a predict_proba method (e.g. gcForest).
+
+        :param n_channels: int (default=2)
+            Number of channels of the stream.
+
+        :param fs: float (default=1000)
+            Sampling frequency in Hz.
+
+        :param window: int (default=4992)
+            Number of points the features are computed on.
+            (window - nperseg) must be a multiple of nperseg // 2.
+
+        :param update_ms: float (default=250)
+            Time between two updates of the probabilities, in ms of signal, rounded to
+            a multiple of nperseg // 2 points (256 points for the defaults).
+
+        :param neighborhood: int (default=4)
+            Number of neighbours taken on each side of the center for the LBP.
+
+        :param nperseg: int (default=256)
+            Length of the Welch segments (consecutive segments overlap by half).
+
+        :param latency_budget_ms: float (default=None)
+            Expected maximum time of an update. It is only monitored, not enforced (a
+            prediction is not interrupted): the updates over the budget are counted in
+            n_overruns. Whatever the chunk size, a single update (the last one reached)
+            is computed per chunk, so a slow model skips updates instead of falling behind.
+
+        :param lowcut, highcut, order:
+            Band-pass filter, see preprocessing.butter_bandpass_sos.
+        """
+        hop = nperseg // 2
+        if window < nperseg or (window - nperseg) % hop:
+            raise ValueError('(window - nperseg) must be a non negative multiple of nperseg // 2')
+
+        setattr(self, 'model', model)
+        setattr(self, 'n_channels', n_channels)
+        setattr(self, 'fs', fs)
+        setattr(self, 'window', window)
+        setattr(self, 'update_points', hop * max(1, int(round(fs * update_ms / 1000. / hop))))
+        setattr(self, 'neighborhood', neighborhood)
+        setattr(self, 'nperseg', nperseg)
+        setattr(self, 'latency_budget_ms', latency_budget_ms)
+        setattr(self, 'bandpass', StreamingBandpass(n_channels, lowcut, highcut, fs, order))
+        self.reset()
+
+    def reset(self):
+        """ Forget the stream (start of a new acquisition session). """
+        n_channels = getattr(self, 'n_channels')
+        neighborhood = getattr(self, 'neighborhood')
+        nperseg = getattr(self, 'nperseg')
+        window = getattr(self, 'window')
+        n_segments = (window - nperseg) // (nperseg // 2) + 1
+
+        self.bandpass.reset()
+        setattr(self, 'n_seen', 0)
+        setattr(self, '_tail', np.zeros((n_channels, 0)))
+        setattr(self, '_n_codes', 0)
+        setattr(self, '_codes', np.zeros((n_channels, window - 2 * neighborhood), dtype=np.int64))
+        setattr(self, '_hist', np.zeros((n_channels, 1 << (2 * neighborhood)), dtype=np.int64))
+        setattr(self, '_n_psd', 0)
+        setattr(self, '_psd', np.zeros((n_channels, n_segments, nperseg // 2 + 1)))
+        setattr(self, 'last_update', None)
+        setattr(self, 'latencies', collections.deque(maxlen=1000))
+        setattr(self, 'n_overruns', 0)
+
+    def push(self, chunk):
+        """ Feed the next raw chunk of the stream.
+
+        :param chunk: np.array
+            Array of shape [n_channels, n_points] of raw (mean-centred) samples.
+
+        :return: tuple or None
+            (n_update, proba) if the probabilities were updated during this chunk, where
+            n_update is the end of the window the features were computed on (in points
+            from the start of the stream) and proba the class probabilities predicted by
+            the model, None otherwise.
+        """
+        n_seen = getattr(self, 'n_seen')
+        hop = getattr(self, 'nperseg') // 2
+        update_points = getattr(self, 'update_points')
+
+        y = self.bandpass.filter(np.asarray(chunk, dtype=np.float64))
+        buf = np.concatenate((self._tail, y), axis=1)
+        buf_start = n_seen - self._tail.shape[1]
+        n_total = n_seen + y.shape[1]
+        setattr(self, 'n_seen', n_total)
+
+        n_update = n_total // update_points * update_points
+        update = n_update > n_seen and n_update >= getattr(self, 'window')
+        if update:
+            self._advance(buf, buf_start, n_update)
+            features = self.current_features()
+        self._advance(buf, buf_start, n_total // hop * hop)
+        setattr(self, '_tail', buf[:, min(self._n_psd * hop, self._n_codes) - buf_start:])
+        if not update:
+            return None
+
+        tic = time.perf_counter()
+        proba = self.model.predict_proba(features[None])[0]
+        latency = 1000 * (time.perf_counter() - tic)
+        self.latencies.append(latency)
+        budget = getattr(self, 'latency_budget_ms')
+        if budget is not None and latency > budget:
+            self.n_overruns += 1
+        setattr(self, 'last_update', (n_update, proba))
+
+        return self.last_update
+
+    def current_features(self):
+        """ Feature row of the last 'window' points of the segment grid received (at most
+        nperseg // 2 - 1 points before the last point received).
+
+        :return: np.array
+            1D array [PSD of each channel, LBP histogram of each channel].
+        """
+        n_segments = self._psd.shape[1]
+        psd = self._psd[:, :min(self._n_psd, n_segments)].mean(axis=1)
+
+        return np.concatenate((psd.ravel(), self._hist.ravel().astype(np.float64)))
+
+    def _advance(self, buf, buf_start, stop):
+        """ Add the LBP codes and the Welch segments of the stream up to point 'stop'
+        (excluded), buf holding the points from buf_start on.
+        """
+        neighborhood = getattr(self, 'neighborhood')
+        nperseg = getattr(self, 'nperseg')
+        hop = nperseg // 2
+
+        # LBP codes of the centers whose right neighbours are before stop.
+        first_center = neighborhood + self._n_codes
+        if stop - neighborhood > first_center:
+            self._add_codes(lbp_codes(buf[:, first_center - neighborhood - buf_start:stop - buf_start], neighborhood))
+
+        # Periodograms of the Welch segments ending before stop.
+        n_psd = max(0, (stop - nperseg) // hop + 1)
+        if n_psd > self._n_psd:
+            starts = np.arange(self._n_psd, n_psd) * hop - buf_start
+            segments = sliding_window_view(100 * buf, nperseg, axis=1)[:, starts]
+            self._add_periodograms(psd_values(segments, getattr(self, 'fs'))[1])
+
+    def _add_codes(self, codes):
+        """ Add new LBP codes to the rolling histogram, removing the ones leaving the window. """
+        size = self._codes.shape[1]
+        n_bins = self._hist.shape[1]
+        offset = np.arange(len(codes))[:, None] * n_bins
+
+        def count(c):
+            return np.bincount((c + offset).ravel(), minlength=self._hist.size).reshape(self._hist.shape)
+
+        n_new = codes.shape[1]
+        if n_new >= size:
+            self._n_codes += n_new - size
+            codes = codes[:, -size:]
+            self._hist[...] = count(codes)
+        else:
+            # Slots already holding a code of the window are the ones written size codes ago.
+            first_old = max(0, size - self._n_codes)
+            slots = (self._n_codes + np.arange(n_new)) % size
+            if first_old < n_new:
+                self._hist -= count(self._codes[:, slots[first_old:]])
+            self._hist += count(codes)
+
+        slots = (self._n_codes + np.arange(codes.shape[1])) % size
+        self._codes[:, slots] = codes
+        self._n_codes += codes.shape[1]
+
+    def _add_periodograms(self, periodograms):
+        """ Add new segment periodograms of shape [n_channels, n_new, n_freqs] to the ring. """
+        size = self._psd.shape[1]
+        n_new = periodograms.shape[1]
+        if n_new > size:
+            periodograms = periodograms[:, -size:]
+            self._n_psd += n_new - size
+            n_new = size
+
+        slots = (self._n_psd + np.arange(n_new)) % size
+        self._psd[:, slots] = periodograms
+        self._n_psd += n_new
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The modules of the repository are flat files at its root.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
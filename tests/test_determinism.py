@@ -0,0 +1,26 @@
+#!usr/bin/env python
+# gcForest trained twice with the same random_state gives the same model, whatever n_jobs.
+
+import numpy as np
+import pytest
+from sklearn.datasets import load_digits
+
+from GCForest import gcForest
+
+
+@pytest.mark.parametrize('forest_backend', ['exact', 'hist'])
+@pytest.mark.parametrize('version', [0, 1])
+def test_same_random_state_same_model(version, forest_backend):
+    X, y = load_digits(return_X_y=True)
+    X, y = X[:400], y[:400] % 3
+
+    models = []
+    for n_jobs in (1, 2):
+        model = gcForest(shape_1X=[8, 8], window=[4], stride=2, n_mgsRF=1, n_mgsRFtree=10, n_cascadeRF=1,
+                         n_cascadeRFtree=20, max_cascade_layer=4, version=version, forest_backend=forest_backend,
+                         n_jobs=n_jobs, random_state=7)
+        model.fit(X[:300], y[:300])
+        models.append(model)
+
+    assert models[0].n_layer == models[1].n_layer
+    np.testing.assert_array_equal(models[0].predict_proba(X[300:]), models[1].predict_proba(X[300:]))
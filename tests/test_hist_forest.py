@@ -0,0 +1,47 @@
+#!usr/bin/env python
+# histogram random forest: bins, split search and out-of-bag class vectors.
+
+import numpy as np
+from sklearn.datasets import load_digits
+
+import hist_forest
+from hist_forest import HistRandomForestClassifier, bin_features
+
+
+def test_bins_match_edges():
+    rng = np.random.default_rng(0)
+    X = np.round(rng.normal(size=(500, 6)), 1)
+    X[::9, 2] = np.nan
+    codes, edges = bin_features(X, n_bins=16)
+
+    assert codes.dtype == np.uint8
+    for k in range(edges.shape[0]):
+        # 'bin <= k' is 'value <= edge', NaN goes above every edge.
+        np.testing.assert_array_equal(codes <= k, X.astype(np.float32) <= edges[k])
+
+
+def test_hist_and_sorted_split_search_agree(monkeypatch):
+    X, y = load_digits(return_X_y=True)
+    X, y = X[:600], y[:600] % 3
+
+    forests = []
+    for ratio in (0, 10 ** 9):
+        monkeypatch.setattr(hist_forest, '_HIST_MIN_RATIO', ratio)
+        forests.append(HistRandomForestClassifier(n_estimators=10, random_state=0).fit(X, y))
+
+    np.testing.assert_array_equal(forests[0].packed_.nodes, forests[1].packed_.nodes)
+    np.testing.assert_array_equal(forests[0].packed_.value, forests[1].packed_.value)
+
+
+def test_oob_class_vectors():
+    X, y = load_digits(return_X_y=True)
+    y = y % 3
+    weight = np.where(y == 1, 32.0, 1.0)
+    forest = HistRandomForestClassifier(n_estimators=30, oob_score=True, random_state=0)
+    forest.fit(X[:1000], y[:1000], sample_weight=weight[:1000])
+
+    assert forest.oob_decision_function_.shape == (1000, 3)
+    np.testing.assert_allclose(forest.oob_decision_function_.sum(axis=1), 1.0)
+    assert forest.oob_score_ > 0.8
+    assert np.isclose(forest.feature_importances_.sum(), 1.0)
+    assert np.mean(forest.predict(X[1000:]) == y[1000:]) > 0.8